@@ -1,21 +1,39 @@
-import os
+# Imported first so the startup timer covers every other import
+from tools.startup import StartupTimer, lazy_handler
+
+import asyncio
 import logging
-from redis import Redis
+import random
+import sys
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
 
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, JobQueue, MessageHandler, filters, \
     CallbackQueryHandler
 
-# from coingecko_api.cg import check_trending, check_coin_info
 from binance_api.bn import remove_alert, set_alert, list_alerts, check_price, set_custom_check, check_custom_list, \
-    refresh_prices_callback, check_alerts, check_value
-
-from tools.init import TELEGRAM_API_KEY
+    refresh_prices_callback, check_alerts, check_alerts_on_tick, check_value
+
+from binance_api.alert_index import build_alert_index
+from binance_api.scheduler import check_alerts_adaptive
+from binance_api.candles import load_candles, persist_candles, save_candles
+from binance_api.utils import load_price_snapshot, persist_price_snapshot, save_price_snapshot
+from tools.binance_gateway import BACKGROUND, background, set_priority
+from tools.http_client import close_client
+from tools.metrics import instrument_handler, instrument_redis, start_metrics_server
+from tools.notifier import get_notifier
+from tools.symbols import load_symbols, sync_symbols
+from tools.init import TELEGRAM_API_KEY, TELEGRAM_API_URL, STREAM_MODE, ALERT_INTERVAL, ALERT_WORKERS, \
+    ALERT_SCHEDULER, ALERT_MIN_INTERVAL, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, \
+    WEBHOOK_MAX_CONNECTIONS, CONCURRENT_UPDATES, SHUTDOWN_TIMEOUT, ALERT_START_JITTER, redis_client
 
 # Initialize logging
 logging.basicConfig(level=logging.INFO)
 
+# Started in on_startup, before the application runs, so they are cancelled in on_shutdown
+_background_tasks = []
+startup = StartupTimer("Bot")
+
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
@@ -28,6 +46,62 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+# Runs before the first update is fetched, so handlers only ever see warm caches
+async def on_startup(app):
+    startup.mark("initialize")
+    # Startup and the stream started here yield the Binance weight budget to user commands
+    set_priority(BACKGROUND)
+    instrument_redis(redis_client)
+    start_metrics_server()
+
+    # Index alerts stored before the trigger index existed
+    await build_alert_index()
+    # Restore what the previous run left in Redis: candles so interval changes need no klines
+    # backfill, the symbol registry so user input is validated locally, and the last prices
+    await asyncio.gather(startup.timed("candles", load_candles()), startup.timed("symbols", load_symbols()),
+                         startup.timed("prices", load_price_snapshot()))
+    startup.mark("restore")
+    # Refresh the registry upstream, if it is due, without holding up startup
+    _background_tasks.append(asyncio.create_task(sync_symbols()))
+    # Resend alerts that were still queued when the previous process stopped
+    await get_notifier(app.bot).start()
+    startup.mark("notifier")
+
+    if STREAM_MODE:
+        from binance_api.stream import run_stream
+
+        # With dedicated alert workers the stream only keeps the price table live for commands
+        on_tick = None if ALERT_WORKERS else lambda prices: check_alerts_on_tick(app.bot, prices)
+        _background_tasks.append(asyncio.create_task(run_stream(on_tick)))
+
+    startup.done()
+
+
+# Runs once the update server is closed and Application.stop() has waited for in-flight
+# handlers and the running alert job
+async def on_shutdown(app):
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+
+    # Whatever is not delivered in time stays in the Redis backlog for the next start
+    notifier = get_notifier(app.bot)
+    await notifier.drain(SHUTDOWN_TIMEOUT)
+    await notifier.stop()
+
+    # Leave warm caches for the next process
+    try:
+        await asyncio.gather(save_candles(), save_price_snapshot())
+    except Exception as e:
+        logging.error(f"Error saving caches on shutdown: {e}")
+
+    # The chart module is only loaded once /chart was used
+    chart = sys.modules.get("binance_api.chart")
+    if chart is not None:
+        chart.shutdown_pool()
+    await close_client()
+
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     help_text = (
         "🤖 I'm CryptoBot! Here are the commands you can use:\n\n"
@@ -41,36 +115,63 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "/pxc <name> - Check the prices of coins in the custom list by its name\n"
         "/ppp <name> - Check information for a coin on CoinGecko (e.g., BTC, ETH)\n"
         "/trending - Check top 7 trending coins on CoinGecko\n"
-        "/value <amount> <name>"
+        "/chart <coin_id> [interval] - Candlestick chart of a coin (e.g., /chart btc 4h)\n"
+        "/value <amount> <coin> [to ...] - Convert between any Binance assets (e.g., /value 2 eth btc eur)"
     )
 
     await update.message.reply_text(help_text)
 
 
 def main():
+    startup.mark("imports")
     job_queue = JobQueue()
-    app = ApplicationBuilder().token(TELEGRAM_API_KEY).job_queue(job_queue).build()
+    app = ApplicationBuilder().token(TELEGRAM_API_KEY).base_url(TELEGRAM_API_URL).job_queue(job_queue) \
+        .concurrent_updates(CONCURRENT_UPDATES).post_init(on_startup).post_stop(on_shutdown).build()
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("remove", remove_alert))
-    app.add_handler(CommandHandler("set", set_alert))
-    app.add_handler(CommandHandler("list", list_alerts))
-    app.add_handler(MessageHandler(filters.Regex(r'^(?:/|)[Pp](?:\s|$)'), check_price))
-    app.add_handler(MessageHandler(filters.Regex(r'^(?:/|)[Vv][Aa][Ll][Uu][Ee](?:\s|$)'), check_value))
+    app.add_handler(CommandHandler("remove", instrument_handler(remove_alert)))
+    app.add_handler(CommandHandler("set", instrument_handler(set_alert)))
+    app.add_handler(CommandHandler("list", instrument_handler(list_alerts)))
+    app.add_handler(MessageHandler(filters.Regex(r'^(?:/|)[Pp](?:\s|$)'), instrument_handler(check_price)))
+    app.add_handler(MessageHandler(filters.Regex(r'^(?:/|)[Vv][Aa][Ll][Uu][Ee](?:\s|$)'),
+                                   instrument_handler(check_value)))
 
-    app.add_handler(CommandHandler("px", set_custom_check))
-    app.add_handler(CommandHandler("pxc", check_custom_list))
+    app.add_handler(CommandHandler("px", instrument_handler(set_custom_check)))
+    app.add_handler(CommandHandler("pxc", instrument_handler(check_custom_list)))
+    app.add_handler(CommandHandler("chart", instrument_handler(lazy_handler("binance_api.chart", "check_chart"))))
 
     # Add callback handler for the Refresh button
-    app.add_handler(CallbackQueryHandler(refresh_prices_callback, pattern="^refresh"))
+    app.add_handler(CallbackQueryHandler(instrument_handler(refresh_prices_callback), pattern="^refresh"))
     # Coingecko Trending
-    # app.add_handler(CommandHandler("trending", check_trending))
-    # app.add_handler(CommandHandler("ppp", check_coin_info))
-
-    job_queue.run_repeating(check_alerts, interval=180, first=0)
+    app.add_handler(CommandHandler("trending", instrument_handler(lazy_handler("coingecko_api.cg", "check_trending"))))
+    app.add_handler(CommandHandler("ppp", instrument_handler(lazy_handler("coingecko_api.cg", "check_coin_info"))))
+
+    # Alert jobs run here unless dedicated workers evaluate them. In streaming mode they are the
+    # REST fallback and skip themselves while the stream is live. The first cycle is staggered so
+    # replicas restarted together do not fetch upstream at the same moment.
+    first = random.uniform(0, ALERT_START_JITTER)
+    if ALERT_WORKERS:
+        logging.info("Alerts are evaluated by worker.py processes")
+    elif ALERT_SCHEDULER == "adaptive":
+        job_queue.run_repeating(instrument_handler(background(check_alerts_adaptive)), interval=ALERT_MIN_INTERVAL,
+                                first=first)
+    else:
+        job_queue.run_repeating(instrument_handler(background(check_alerts)), interval=ALERT_INTERVAL, first=first)
+
+    job_queue.run_repeating(persist_candles, interval=300, first=300)
+    job_queue.run_repeating(persist_price_snapshot, interval=60, first=60)
+    job_queue.run_repeating(background(sync_symbols), interval=600, first=600)
 
     job_queue.start()
-    app.run_polling()
+    if WEBHOOK_URL:
+        if not WEBHOOK_SECRET:
+            logging.warning("WEBHOOK_SECRET is not set, the webhook accepts updates from anyone")
+        # Every replica registers the same URL, so several can sit behind one load balancer
+        app.run_webhook(listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, url_path=WEBHOOK_PATH,
+                        webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET or None,
+                        max_connections=WEBHOOK_MAX_CONNECTIONS)
+    else:
+        app.run_polling()
 
 
 if __name__ == "__main__":
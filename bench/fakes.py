@@ -0,0 +1,185 @@
+import asyncio
+import json
+import time
+from collections import Counter
+from urllib.parse import urlsplit, parse_qs
+
+# Minimal local stand-ins for the Binance REST API and the Telegram Bot API. They speak
+# just enough HTTP/1.1 (with keep-alive) for httpx, and count every request by path.
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 418: "I'm a teapot", 429: "Too Many Requests"}
+
+
+class FakeHTTPServer:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = Counter()
+        self.server = None
+        self.port = None
+        self.connections = set()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self, port: int = 0):
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        for writer in list(self.connections):
+            writer.close()
+        while self.connections:
+            await asyncio.sleep(0.01)
+        await self.server.wait_closed()
+
+    # Return (status, payload) or (status, payload, headers)
+    def handle(self, method: str, path: str, params: dict):
+        raise NotImplementedError
+
+    async def _serve(self, reader, writer):
+        self.connections.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, _ = request_line.decode().split(" ", 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode().split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                url = urlsplit(target)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if body:
+                    if headers.get("content-type", "").startswith("application/json"):
+                        params.update(json.loads(body))
+                    else:
+                        params.update({key: values[0] for key, values in parse_qs(body.decode()).items()})
+
+                self.requests[url.path] += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+
+                status, payload, *extra = self.handle(method, url.path, params)
+                data = json.dumps(payload).encode()
+                head = [f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}", "Content-Type: application/json",
+                        f"Content-Length: {len(data)}"]
+                head += [f"{name}: {value}" for name, value in (extra[0] if extra else {}).items()]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+
+class FakeBinance(FakeHTTPServer):
+    # Request weights as Binance charges them: (with a symbol parameter, without)
+    WEIGHTS = {"/api/v3/ticker/price": (2, 4), "/api/v3/klines": (2, 2), "/api/v3/exchangeInfo": (20, 20)}
+
+    # With weight_limit set, requests over the limit within a window get 429 and requests made
+    # before the Retry-After of a 429 has passed get 418 with a ban, as Binance does
+    def __init__(self, coins: list, latency: float = 0.0, price: float = 100.0, weight_limit: int = None,
+                 window: float = 60.0, ban_seconds: float = 120.0):
+        super().__init__(latency)
+        self.prices = {f"{coin.upper()}USDT": price for coin in coins}
+        self.weight_limit = weight_limit
+        self.window = window
+        self.ban_seconds = ban_seconds
+        self.window_start = time.time()
+        self.used_weight = 0
+        self.retry_at = 0.0
+        self.limited = Counter()
+
+    def move(self, coins: list, percent: float):
+        for coin in coins:
+            self.prices[f"{coin.upper()}USDT"] *= 1 + percent / 100
+
+    def klines(self, symbol: str, interval: str, limit: int):
+        seconds = {"m": 60, "h": 3600, "d": 86400}[interval[-1]] * int(interval[:-1])
+        now = int(time.time()) // seconds * seconds
+        price = str(self.prices[symbol])
+        return [[(now - i * seconds) * 1000, price, price, price, price, "0", (now - i * seconds + seconds) * 1000 - 1]
+                for i in reversed(range(limit))]
+
+    def handle(self, method: str, path: str, params: dict):
+        if self.weight_limit is None:
+            return self.route(path, params)
+
+        now = time.time()
+        if now - self.window_start >= self.window:
+            self.window_start = now - (now - self.window_start) % self.window
+            self.used_weight = 0
+
+        if now < self.retry_at:
+            self.limited[418] += 1
+            self.retry_at = max(self.retry_at, now + self.ban_seconds)
+            return 418, {"code": -1003, "msg": "IP banned."}, {"Retry-After": int(self.retry_at - now) + 1}
+
+        single, bulk = self.WEIGHTS.get(path, (1, 1))
+        self.used_weight += single if "symbol" in params else bulk
+        headers = {"X-MBX-USED-WEIGHT-1m": self.used_weight}
+        if self.used_weight > self.weight_limit:
+            self.limited[429] += 1
+            retry_after = int(self.window_start + self.window - now) + 1
+            self.retry_at = now + retry_after
+            return 429, {"code": -1003, "msg": "Too many requests."}, {**headers, "Retry-After": retry_after}
+
+        status, payload = self.route(path, params)
+        return status, payload, headers
+
+    def route(self, path: str, params: dict):
+        if path == "/api/v3/ticker/price":
+            symbol = params.get("symbol")
+            if symbol:
+                if symbol not in self.prices:
+                    return 400, {"code": -1121, "msg": "Invalid symbol."}
+                return 200, {"symbol": symbol, "price": str(self.prices[symbol])}
+            return 200, [{"symbol": symbol, "price": str(price)} for symbol, price in self.prices.items()]
+
+        if path == "/api/v3/klines":
+            if params.get("symbol") not in self.prices:
+                return 400, {"code": -1121, "msg": "Invalid symbol."}
+            return 200, self.klines(params["symbol"], params.get("interval", "1d"), int(params.get("limit", 500)))
+
+        if path == "/api/v3/exchangeInfo":
+            return 200, {"symbols": [{"symbol": symbol, "status": "TRADING", "baseAsset": symbol[:-4],
+                                      "quoteAsset": "USDT"} for symbol in self.prices]}
+
+        return 404, {"code": -1, "msg": "Not found."}
+
+
+class FakeTelegram(FakeHTTPServer):
+    def __init__(self, latency: float = 0.0):
+        super().__init__(latency)
+        self.message_id = 0
+        self.sent = Counter()
+
+    def message(self, chat_id, text):
+        self.message_id += 1
+        return {"message_id": self.message_id, "date": int(time.time()), "text": text,
+                "chat": {"id": int(chat_id), "type": "private"}}
+
+    def handle(self, method: str, path: str, params: dict):
+        api_method = path.rsplit("/", 1)[-1]
+
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif api_method in ("sendMessage", "editMessageText"):
+            if api_method == "sendMessage":
+                self.sent[int(params["chat_id"])] += 1
+            result = self.message(params["chat_id"], params.get("text", ""))
+        else:
+            result = True
+
+        return 200, {"ok": True, "result": result}
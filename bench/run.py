@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import time
+from types import SimpleNamespace
+
+from bench.fakes import FakeBinance, FakeTelegram
+
+# Offline benchmark of the alert cycle and the /set, /p and Refresh handlers. The real
+# handlers run against local fake Binance and Telegram servers and a local Redis
+# (REDIS_DB 15 by default, which is flushed) or fakeredis.
+#
+#   python -m bench.run --users 1000 --coins-per-user 5 --symbols 50 --latency 0.05 --output bench.json
+
+TOKEN = "123456:bench"
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def summarize(latencies: list):
+    return {"count": len(latencies), "p50": percentile(latencies, 0.5), "p99": percentile(latencies, 0.99)}
+
+
+# Point the shared client at an in-process fakeredis server, behind the same kind of pool
+def use_fake_redis(client):
+    import fakeredis
+    from fakeredis.aioredis import FakeConnection
+    from redis.asyncio import BlockingConnectionPool
+
+    client.connection_pool = BlockingConnectionPool(connection_class=FakeConnection, server=fakeredis.FakeServer(),
+                                                    max_connections=client.connection_pool.max_connections)
+
+
+async def timed(concurrency: int, calls: list):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def run(call):
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(run(call) for call in calls))
+    return latencies
+
+
+def message_update(bot, update_id: int, user_id: int, text: str):
+    from telegram import Update
+
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": int(time.time()), "text": text,
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": user_id, "is_bot": False, "first_name": "bench"}},
+    }, bot)
+
+
+def callback_update(bot, update_id: int, user_id: int, message_id: int, data: str):
+    from telegram import Update
+
+    return Update.de_json({
+        "update_id": update_id,
+        "callback_query": {"id": str(update_id), "chat_instance": "bench", "data": data,
+                           "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+                           "message": {"message_id": message_id, "date": int(time.time()), "text": "",
+                                       "chat": {"id": user_id, "type": "private"}}},
+    }, bot)
+
+
+async def run_bench(args):
+    rng = random.Random(args.seed)
+    coins = [f"c{i}" for i in range(args.symbols)]
+    binance = await FakeBinance(coins, latency=args.latency, weight_limit=args.weight_limit).start()
+    telegram = await FakeTelegram().start()
+
+    # The bot reads its configuration at import time, so point it at the fakes first
+    os.environ.update({
+        "BINANCE_API_URL": binance.url,
+        "BINANCE_MIRRORS": "",
+        "COINGECKO_FALLBACK": "false",
+        "REDIS_HOST": os.environ.get("REDIS_HOST", "localhost"),
+        "REDIS_DB": str(args.redis_db),
+        "PERCENTAGE_CHANGE": str(args.percentage_change),
+        "NOTIFY_GLOBAL_RATE": str(args.notify_rate),
+        "NOTIFY_CHAT_RATE": str(args.notify_rate),
+        "REFRESH_THROTTLE": "0",
+        "RENDER_CACHE_TTL": "0",
+    })
+    from telegram import Bot
+    from telegram.request import HTTPXRequest
+    from binance_api import bn
+    from binance_api.alert_index import build_alert_index
+    from binance_api.utils import expire_price_snapshot
+    from tools.http_client import close_client
+    from tools.init import redis_client
+    from tools.metrics import instrument_redis, redis_round_trips
+    from tools.notifier import get_notifier
+
+    if args.fake_redis:
+        use_fake_redis(redis_client)
+    await redis_client.flushdb()
+    instrument_redis(redis_client)
+
+    bot = Bot(TOKEN, base_url=f"{telegram.url}/bot", request=HTTPXRequest(connection_pool_size=args.concurrency))
+    await bot.initialize()
+    notifier = get_notifier(bot)
+    await notifier.start()
+    await build_alert_index()
+    context = SimpleNamespace(bot=bot, args=[], job=None)
+
+    update_id = 0
+
+    def next_id():
+        nonlocal update_id
+        update_id += 1
+        return update_id
+
+    # /set: every user subscribes to coins-per-user random symbols
+    subscriptions = {user_id: rng.sample(coins, min(args.coins_per_user, len(coins)))
+                     for user_id in range(1, args.users + 1)}
+
+    def set_call(user_id, user_coins):
+        update = message_update(bot, next_id(), user_id, "/set " + " ".join(user_coins))
+        return lambda: bn.set_alert(update, SimpleNamespace(bot=bot, args=user_coins))
+
+    set_latencies = await timed(args.concurrency, [set_call(user_id, user_coins)
+                                                    for user_id, user_coins in subscriptions.items()])
+
+    # Alert cycle: move a share of the symbols past the threshold and evaluate once
+    moved = rng.sample(coins, int(len(coins) * args.move_fraction))
+    binance.move(moved, args.percentage_change + 1)
+    expire_price_snapshot()
+    binance.requests.clear()
+    round_trips = redis_round_trips()
+    sent_before = sum(telegram.sent.values())
+
+    start = time.perf_counter()
+    await bn.check_alerts(context)
+    cycle_time = time.perf_counter() - start
+    cycle_requests = sum(binance.requests.values())
+    cycle_round_trips = int(redis_round_trips() - round_trips)
+
+    start = time.perf_counter()
+    await notifier.drain()
+    delivery_time = time.perf_counter() - start
+    messages_sent = sum(telegram.sent.values()) - sent_before
+    moved_set = set(moved)
+    alerts_fired = sum(len(moved_set.intersection(user_coins)) for user_coins in subscriptions.values())
+
+    # /p with random coin lists, then Refresh on the resulting messages
+    def price_call(user_id):
+        update = message_update(bot, next_id(), user_id, "p " + " ".join(rng.sample(coins, min(3, len(coins)))))
+        return lambda: bn.check_price(update, context)
+
+    def refresh_call(user_id):
+        data = "refresh " + " ".join(rng.sample(coins, min(3, len(coins))))
+        update = callback_update(bot, next_id(), user_id, next_id(), data)
+        return lambda: bn.refresh_prices_callback(update, context)
+
+    price_latencies = await timed(args.concurrency, [price_call(rng.randint(1, args.users))
+                                                      for _ in range(args.requests)])
+    refresh_latencies = await timed(args.concurrency, [refresh_call(rng.randint(1, args.users))
+                                                        for _ in range(args.requests)])
+
+    await notifier.stop()
+    await bot.shutdown()
+    await close_client()
+    await redis_client.flushdb()
+    await binance.stop()
+    await telegram.stop()
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+
+    return {
+        "commit": commit,
+        "params": {"users": args.users, "coins_per_user": args.coins_per_user, "symbols": args.symbols,
+                   "latency": args.latency, "move_fraction": args.move_fraction},
+        "cycle": {
+            "wall_time": cycle_time,
+            "delivery_time": delivery_time,
+            "upstream_requests": cycle_requests,
+            "redis_round_trips": cycle_round_trips,
+            "alerts_fired": alerts_fired,
+            "messages_sent": messages_sent,
+        },
+        # Responses refused by the fake's weight limit, by status (429, 418)
+        "rate_limited": {str(status): count for status, count in binance.limited.items()},
+        "handlers": {
+            "set": summarize(set_latencies),
+            "p": summarize(price_latencies),
+            "refresh": summarize(refresh_latencies),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the alert cycle and command handlers offline")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--coins-per-user", type=int, default=5)
+    parser.add_argument("--symbols", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every upstream response")
+    parser.add_argument("--move-fraction", type=float, default=0.5, help="share of symbols moved past the threshold")
+    parser.add_argument("--percentage-change", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=200, help="/p and Refresh calls to time")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--notify-rate", type=float, default=1e6, help="messages per second allowed to Telegram")
+    parser.add_argument("--weight-limit", type=int, help="request weight per minute the fake Binance allows")
+    parser.add_argument("--redis-db", type=int, default=15)
+    parser.add_argument("--fake-redis", action="store_true", help="use fakeredis[lua] instead of a local Redis")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_bench(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import random
+import subprocess
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+from bench.run import percentile, use_fake_redis
+
+# Market simulation: replays recorded Binance prices through the real alert cycle
+# (check_alerts or the adaptive scheduler, get_price_change and the alert messages) at
+# accelerated time, to see how many alerts and messages a PERCENTAGE_CHANGE and a user
+# population produce before changing production settings.
+#
+#   python -m bench.simulate record market.jsonl.gz --duration 86400 --interval 10
+#   python -m bench.simulate replay market.jsonl.gz --users 1000 --coins-per-user 5 --percentage-change 3 --fake-redis
+#
+# A bot started with HTTP_RECORD_PATH=market.jsonl.gz records the same format. During replay a
+# clock driven by the recording replaces the time module in the modules that read it, Binance
+# is answered in-process from the recorded prices, and a stand-in bot counts what Telegram
+# would have received. Redis is REDIS_DB 15 (flushed) or fakeredis, as in bench.run.
+
+INTERVAL_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+# Stands in for the time module; everything but the wall and monotonic clocks is the real one
+class ReplayClock:
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+# Recorded prices of the simulated symbols, as a series of (time, price) per symbol
+class MarketHistory:
+    def __init__(self):
+        self.ticks = []
+        self.series = {}
+
+    # pick(prices) chooses the symbols from the first recorded ticker
+    @classmethod
+    def load(cls, path: str, pick):
+        from tools.recorder import read_records
+
+        history = cls()
+        for entry in read_records(path):
+            prices = entry.get("prices")
+            if prices is None:
+                continue
+            if not history.series:
+                history.series = {symbol: ([], []) for symbol in pick(prices)}
+
+            history.ticks.append(entry["time"])
+            for symbol, (times, values) in history.series.items():
+                price = prices.get(symbol)
+                if price is not None:
+                    times.append(entry["time"])
+                    values.append(float(price))
+        return history
+
+    def price_at(self, symbol: str, ts: float):
+        times, values = self.series[symbol]
+        index = bisect.bisect_right(times, ts) - 1
+        return values[index] if index >= 0 else None
+
+    # OHLC candles up to ts built from the recorded prices, in the Binance klines format
+    def klines(self, symbol: str, seconds: int, limit: int, ts: float):
+        times, values = self.series[symbol]
+        end = int(ts) // seconds * seconds
+        klines = []
+        for open_time in range(end - (limit - 1) * seconds, end + seconds, seconds):
+            close_time = min(open_time + seconds - 1, ts)
+            window = values[bisect.bisect_left(times, open_time):bisect.bisect_right(times, close_time)]
+            if window:
+                candle = (window[0], max(window), min(window), window[-1])
+            else:
+                # No tick in this candle: flat at the last price, if the recording has started
+                price = self.price_at(symbol, open_time)
+                if price is None:
+                    continue
+                candle = (price, price, price, price)
+            klines.append([open_time * 1000, *map(str, candle), "0", (open_time + seconds) * 1000 - 1])
+        return klines
+
+
+# Answers the Binance REST requests of the bot from the history, at the replay clock's time
+class ReplayBinance:
+    def __init__(self, history: MarketHistory, clock: ReplayClock):
+        self.history = history
+        self.clock = clock
+        self.requests = Counter()
+
+    def prices(self):
+        prices = {}
+        for symbol in self.history.series:
+            price = self.history.price_at(symbol, self.clock.now)
+            if price is not None:
+                prices[symbol] = price
+        return prices
+
+    def handle(self, request):
+        import httpx
+
+        path = request.url.path
+        params = dict(request.url.params)
+        self.requests[path] += 1
+        symbol = params.get("symbol")
+        if symbol is not None and symbol not in self.history.series:
+            return httpx.Response(400, json={"code": -1121, "msg": "Invalid symbol."})
+
+        if path == "/api/v3/ticker/price":
+            prices = self.prices()
+            if symbol:
+                return httpx.Response(200, json={"symbol": symbol, "price": str(prices[symbol])})
+            return httpx.Response(200, json=[{"symbol": symbol, "price": str(price)}
+                                             for symbol, price in prices.items()])
+
+        if path == "/api/v3/klines":
+            interval = params.get("interval", "1d")
+            seconds = INTERVAL_UNITS[interval[-1]] * int(interval[:-1])
+            return httpx.Response(200, json=self.history.klines(symbol, seconds, int(params.get("limit", 500)),
+                                                                self.clock.now))
+
+        if path == "/api/v3/exchangeInfo":
+            return httpx.Response(200, json={"symbols": [{"symbol": symbol, "status": "TRADING",
+                                                          "baseAsset": symbol[:-4], "quoteAsset": "USDT"}
+                                                         for symbol in self.history.series]})
+
+        return httpx.Response(404, json={"code": -1, "msg": "Not found."})
+
+
+# Takes the place of the Telegram bot in the notifier and counts what it would have sent
+class ReplayBot:
+    def __init__(self, clock: ReplayClock):
+        self.clock = clock
+        self.alerts = Counter()
+        # Replay time of every message sent
+        self.sent = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        # The notifier joins the alerts of a cycle with blank lines; an alert has none itself
+        self.alerts[chat_id] += text.count("\n\n") + 1
+        self.sent.append(self.clock.now)
+        return SimpleNamespace(message_id=len(self.sent), chat_id=chat_id, text=text)
+
+
+async def record(path: str, duration: float, interval: float):
+    # The recorder is opened when the HTTP client is imported
+    os.environ["HTTP_RECORD_PATH"] = path
+    from binance_api.sources import fetch_snapshot
+    from tools.http_client import close_client
+
+    deadline = time.monotonic() + duration
+    snapshots = 0
+    try:
+        while time.monotonic() < deadline:
+            start = time.monotonic()
+            try:
+                await fetch_snapshot()
+                snapshots += 1
+            except Exception as e:
+                print(f"Error fetching snapshot: {e}")
+            await asyncio.sleep(max(interval - (time.monotonic() - start), 0))
+    finally:
+        await close_client()
+    print(f"Recorded {snapshots} snapshots to {path}")
+
+
+def pick_symbols(args, rng):
+    def pick(prices: dict):
+        if args.coins:
+            return [f"{coin.strip().upper()}USDT" for coin in args.coins.split(",") if coin.strip()]
+        # Halted pairs are listed at a price of 0
+        listed = sorted(symbol for symbol, price in prices.items() if symbol.endswith("USDT") and float(price))
+        return rng.sample(listed, min(args.symbols, len(listed)))
+
+    return pick
+
+
+def cycle_times(ticks: list, interval: float):
+    times = []
+    for ts in ticks:
+        if not times or ts - times[-1] >= interval:
+            times.append(ts)
+    return times
+
+
+async def replay(args):
+    rng = random.Random(args.seed)
+    history = MarketHistory.load(args.path, pick_symbols(args, rng))
+    if not history.ticks:
+        raise SystemExit(f"No ticker snapshots found in {args.path}")
+
+    # Telegram's limit is what a real deployment delivers at, whatever the simulation does
+    production_rate = float(os.environ.get("NOTIFY_GLOBAL_RATE", 25))
+    # The bot reads its configuration at import time, so set it up first
+    os.environ.update({
+        "BINANCE_MIRRORS": "",
+        "COINGECKO_FALLBACK": "false",
+        "HTTP_RECORD_PATH": "",
+        "REDIS_HOST": os.environ.get("REDIS_HOST", "localhost"),
+        "REDIS_DB": str(args.redis_db),
+        "PERCENTAGE_CHANGE": str(args.percentage_change),
+        "ALERT_SCHEDULER": args.scheduler,
+        "NOTIFY_GLOBAL_RATE": "1e6",
+        "NOTIFY_CHAT_RATE": "1e6",
+    })
+    import httpx
+
+    from binance_api import bn, candles, scheduler, utils
+    from binance_api.alert_index import build_alert_index
+    from binance_api.storage import add_alerts
+    from tools import binance_gateway, http_client
+    from tools.binance_gateway import BACKGROUND, set_priority
+    from tools.init import ALERT_INTERVAL, ALERT_MIN_INTERVAL, redis_client
+    from tools.notifier import get_notifier
+
+    if args.fake_redis:
+        use_fake_redis(redis_client)
+    await redis_client.flushdb()
+
+    clock = ReplayClock(history.ticks[0])
+    for module in (candles, scheduler, utils, binance_gateway):
+        module.time = clock
+    binance = ReplayBinance(history, clock)
+    http_client._client = httpx.AsyncClient(transport=httpx.MockTransport(binance.handle))
+    # Alert cycles are background work in the bot too
+    set_priority(BACKGROUND)
+
+    bot = ReplayBot(clock)
+    notifier = get_notifier(bot)
+    await notifier.start()
+
+    # Every user sets alerts on random coins at the first recorded prices, as /set would
+    prices = binance.prices()
+    coins = [symbol[:-4].lower() for symbol in prices]
+    users = {user_id: rng.sample(coins, min(args.coins_per_user, len(coins))) for user_id in range(1, args.users + 1)}
+    await asyncio.gather(*(add_alerts(user_id, {coin_id: prices[f"{coin_id.upper()}USDT"] for coin_id in coin_ids})
+                           for user_id, coin_ids in users.items()))
+    await build_alert_index()
+
+    if args.scheduler == "adaptive":
+        check = scheduler.check_alerts_adaptive
+        interval = ALERT_MIN_INTERVAL if args.interval is None else args.interval
+    else:
+        check = bn.check_alerts
+        interval = ALERT_INTERVAL if args.interval is None else args.interval
+    context = SimpleNamespace(bot=bot, args=[], job=None)
+
+    times = cycle_times(history.ticks, interval)
+    cycle_cpu = []
+    cycle_wall = []
+    cycle_messages = []
+    started = time.perf_counter()
+    for ts in times:
+        clock.now = ts
+        utils.expire_price_snapshot()
+        sent_before = len(bot.sent)
+
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        await check(context)
+        cycle_cpu.append(time.process_time() - cpu)
+        cycle_wall.append(time.perf_counter() - wall)
+
+        await notifier.drain()
+        cycle_messages.append(len(bot.sent) - sent_before)
+    wall_time = time.perf_counter() - started
+
+    await notifier.stop()
+    await http_client.close_client()
+    await redis_client.flushdb()
+
+    simulated = max(times[-1] - times[0], 1)
+    per_minute = Counter(int(ts // 60) for ts in bot.sent)
+    alerts = [bot.alerts[user_id] for user_id in users]
+    messages = len(bot.sent)
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+
+    return {
+        "commit": commit,
+        "params": {"recording": args.path, "users": args.users, "coins_per_user": args.coins_per_user,
+                   "symbols": len(history.series), "percentage_change": args.percentage_change,
+                   "scheduler": args.scheduler, "interval": interval},
+        "replay": {
+            "cycles": len(times),
+            "simulated_seconds": simulated,
+            "wall_time": wall_time,
+            "speedup": simulated / wall_time if wall_time else None,
+            "upstream_requests": dict(binance.requests),
+        },
+        "alerts": {
+            "fired": sum(alerts),
+            "users_alerted": sum(1 for count in alerts if count),
+            "per_user_mean": sum(alerts) / len(alerts) if alerts else 0.0,
+            "per_user_p50": percentile(alerts, 0.5),
+            "per_user_p99": percentile(alerts, 0.99),
+            "per_user_max": max(alerts, default=0),
+        },
+        "messages": {
+            "sent": messages,
+            "per_second": messages / simulated,
+            "peak_per_minute": max(per_minute.values(), default=0),
+            "peak_per_cycle": max(cycle_messages, default=0),
+            # Time the largest burst takes to go out at the production NOTIFY_GLOBAL_RATE
+            "peak_burst_seconds": max(cycle_messages, default=0) / production_rate,
+            "per_wall_second": messages / wall_time if wall_time else None,
+        },
+        # CPU of the alert cycles alone; with --fake-redis this includes the Redis side too
+        "evaluation_cpu": {
+            "total": sum(cycle_cpu),
+            "per_cycle_mean": sum(cycle_cpu) / len(cycle_cpu),
+            "per_cycle_p99": percentile(cycle_cpu, 0.99),
+            "per_cycle_wall_p99": percentile(cycle_wall, 0.99),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record market data or replay it through the alert cycle")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record")
+    record_parser.add_argument("path")
+    record_parser.add_argument("--duration", type=float, default=3600, help="seconds to record for")
+    record_parser.add_argument("--interval", type=float, default=10, help="seconds between snapshots")
+
+    replay_parser = subparsers.add_parser("replay")
+    replay_parser.add_argument("path")
+    replay_parser.add_argument("--users", type=int, default=1000)
+    replay_parser.add_argument("--coins-per-user", type=int, default=5)
+    replay_parser.add_argument("--symbols", type=int, default=50, help="random USDT pairs to simulate")
+    replay_parser.add_argument("--coins", help="comma separated coins to simulate instead, e.g. btc,eth,sol")
+    replay_parser.add_argument("--percentage-change", type=int, default=3)
+    replay_parser.add_argument("--scheduler", choices=("fixed", "adaptive"), default="fixed")
+    replay_parser.add_argument("--interval", type=float,
+                               help="seconds between cycles (ALERT_INTERVAL, or ALERT_MIN_INTERVAL when adaptive)")
+    replay_parser.add_argument("--redis-db", type=int, default=15)
+    replay_parser.add_argument("--fake-redis", action="store_true", help="use fakeredis[lua] instead of a local Redis")
+    replay_parser.add_argument("--seed", type=int, default=1)
+    replay_parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        asyncio.run(record(args.path, args.duration, args.interval))
+        return
+
+    report = asyncio.run(replay(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import uuid
+
+from tools.init import redis_client, PERCENTAGE_CHANGE, ALERT_CHANGES_MAXLEN
+
+# Alerts are indexed per coin in two sorted sets whose scores are the trigger prices:
+#   alerts:up:<coin>   -> user_id scored by baseline * (1 + threshold%)
+#   alerts:down:<coin> -> user_id scored by baseline * (1 - threshold%)
+# so a cycle only has to range-query the members whose band the current price has left.
+INDEX_VERSION_KEY = "alerts:index:version"
+INDEX_VERSION = "1"
+COINS_KEY = "alerts:coins"
+# Every index write is also appended to this stream, so in-memory copies of the alerts
+# (binance_api/engine.py) can follow along incrementally
+CHANGES_KEY = "alerts:changes"
+# Keys asked for per SCAN call, and alert hashes read per pipelined round trip, in full passes
+SCAN_BATCH = 1000
+
+# Re-arm an alert only if it is still armed and still crossed, so concurrent evaluators
+# cannot fire it twice. Returns the previous baseline, or false when nothing fired.
+REARM_SCRIPT = """
+local baseline = redis.call('HGET', KEYS[1], ARGV[1])
+if not baseline then
+    redis.call('ZREM', KEYS[2], ARGV[2])
+    redis.call('ZREM', KEYS[3], ARGV[2])
+    if redis.call('ZCARD', KEYS[2]) == 0 and redis.call('ZCARD', KEYS[3]) == 0 then
+        redis.call('SREM', KEYS[6], ARGV[1])
+    end
+    return false
+end
+local price = tonumber(ARGV[3])
+local up = redis.call('ZSCORE', KEYS[2], ARGV[2])
+local down = redis.call('ZSCORE', KEYS[3], ARGV[2])
+if not ((up and price >= tonumber(up)) or (down and price <= tonumber(down))) then
+    return false
+end
+local custom = redis.call('HGET', KEYS[4], ARGV[2])
+local threshold = tonumber(custom or ARGV[4])
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[3])
+redis.call('ZADD', KEYS[2], price * (1 + threshold / 100), ARGV[2])
+redis.call('ZADD', KEYS[3], price * (1 - threshold / 100), ARGV[2])
+redis.call('XADD', KEYS[5], 'MAXLEN', '~', ARGV[5], '*', 'op', 'set', 'user', ARGV[2], 'coin', ARGV[1],
+           'price', ARGV[3], 'threshold', custom or '')
+return baseline
+"""
+
+# Drop one alert from the index, and its coin from the indexed coins once no alert is left on it
+UNINDEX_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+if redis.call('ZCARD', KEYS[1]) == 0 and redis.call('ZCARD', KEYS[2]) == 0 then
+    redis.call('SREM', KEYS[4], ARGV[2])
+end
+"""
+
+_rearm = redis_client.register_script(REARM_SCRIPT)
+
+
+def alerts_key(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def up_key(coin_id: str) -> str:
+    return f"alerts:up:{coin_id}"
+
+
+def down_key(coin_id: str) -> str:
+    return f"alerts:down:{coin_id}"
+
+
+def threshold_key(coin_id: str) -> str:
+    return f"alerts:threshold:{coin_id}"
+
+
+def log_change(pipe, op: str, user_id: int, coin_id: str, baseline: float = 0.0, threshold: float = None):
+    pipe.xadd(CHANGES_KEY, {"op": op, "user": user_id, "coin": coin_id, "price": repr(baseline),
+                            "threshold": "" if threshold is None else threshold},
+              maxlen=ALERT_CHANGES_MAXLEN, approximate=True)
+
+
+# Queue the index writes for one alert on a pipeline.
+def index_alert(pipe, user_id: int, coin_id: str, baseline: float, threshold: float = None):
+    log_change(pipe, "set", user_id, coin_id, baseline, threshold)
+    if threshold is None:
+        pipe.hdel(threshold_key(coin_id), user_id)
+        threshold = PERCENTAGE_CHANGE
+    else:
+        pipe.hset(threshold_key(coin_id), user_id, threshold)
+
+    pipe.zadd(up_key(coin_id), {user_id: baseline * (1 + threshold / 100)})
+    pipe.zadd(down_key(coin_id), {user_id: baseline * (1 - threshold / 100)})
+    pipe.sadd(COINS_KEY, coin_id)
+
+
+# Queue the index removals for one alert on a pipeline.
+def unindex_alert(pipe, user_id: int, coin_id: str):
+    log_change(pipe, "del", user_id, coin_id)
+    pipe.eval(UNINDEX_SCRIPT, 4, up_key(coin_id), down_key(coin_id), threshold_key(coin_id), COINS_KEY,
+              user_id, coin_id)
+
+
+async def get_indexed_coins():
+    return [coin.decode("utf-8") for coin in await redis_client.smembers(COINS_KEY)]
+
+
+# Return {coin_id: [user_id, ...]} for every alert whose band the given prices have left.
+async def find_crossed(prices: dict):
+    coin_ids = list(prices)
+    pipe = redis_client.pipeline(transaction=False)
+    for coin_id in coin_ids:
+        pipe.zrangebyscore(up_key(coin_id), "-inf", prices[coin_id])
+        pipe.zrangebyscore(down_key(coin_id), prices[coin_id], "+inf")
+    results = await pipe.execute()
+
+    crossed = {}
+    for i, coin_id in enumerate(coin_ids):
+        users = set(results[2 * i]) | set(results[2 * i + 1])
+        if users:
+            crossed[coin_id] = [int(user_id) for user_id in users]
+    return crossed
+
+
+# Distinct users with an alert on one of the coins, counted server side in one round trip
+async def count_users(coin_ids: list):
+    if not coin_ids:
+        return 0
+
+    key = f"alerts:users:{uuid.uuid4().hex}"
+    pipe = redis_client.pipeline()
+    pipe.zunionstore(key, [up_key(coin_id) for coin_id in coin_ids])
+    pipe.delete(key)
+    return (await pipe.execute())[0]
+
+
+# Return {coin_id: relative distance from the price to the nearest trigger} in one round trip
+async def nearest_triggers(prices: dict):
+    coin_ids = list(prices)
+    pipe = redis_client.pipeline(transaction=False)
+    for coin_id in coin_ids:
+        pipe.zrangebyscore(up_key(coin_id), prices[coin_id], "+inf", start=0, num=1, withscores=True)
+        pipe.zrevrangebyscore(down_key(coin_id), prices[coin_id], "-inf", start=0, num=1, withscores=True)
+    results = await pipe.execute()
+
+    distances = {}
+    for i, coin_id in enumerate(coin_ids):
+        price = prices[coin_id]
+        upper, lower = results[2 * i], results[2 * i + 1]
+        candidates = [upper[0][1] / price - 1] if upper else []
+        candidates += [1 - lower[0][1] / price] if lower else []
+        if candidates:
+            distances[coin_id] = max(min(candidates), 0.0)
+    return distances
+
+
+# Move the baselines of crossed alerts to the current price in one round trip.
+# Returns [(user_id, coin_id, old_price), ...] for the alerts that actually fired.
+async def rearm_alerts(crossed: dict, prices: dict):
+    candidates = [(user_id, coin_id) for coin_id, user_ids in crossed.items() for user_id in user_ids]
+    if not candidates:
+        return []
+
+    pipe = redis_client.pipeline(transaction=False)
+    for user_id, coin_id in candidates:
+        await _rearm(keys=[alerts_key(user_id), up_key(coin_id), down_key(coin_id), threshold_key(coin_id),
+                           CHANGES_KEY, COINS_KEY],
+                     args=[coin_id, user_id, repr(prices[coin_id]), PERCENTAGE_CHANGE, ALERT_CHANGES_MAXLEN],
+                     client=pipe)
+    results = await pipe.execute()
+
+    return [(user_id, coin_id, float(old_price))
+            for (user_id, coin_id), old_price in zip(candidates, results) if old_price is not None]
+
+
+async def _read_alerts(keys: list):
+    pipe = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.hgetall(key)
+    return [(int(key.decode("utf-8").split(":")[1]),
+             {coin_id.decode("utf-8"): float(old_price) for coin_id, old_price in alerts.items()})
+            for key, alerts in zip(keys, await pipe.execute())]
+
+
+# Yield every user's alerts as lists of (user_id, {coin_id: baseline}), one round trip per
+# SCAN_BATCH users instead of one per user
+async def alert_batches():
+    keys = []
+    async for key in redis_client.scan_iter("user:*", count=SCAN_BATCH, _type="hash"):
+        keys.append(key)
+        if len(keys) >= SCAN_BATCH:
+            yield await _read_alerts(keys)
+            keys = []
+    if keys:
+        yield await _read_alerts(keys)
+
+
+# One-time migration that indexes every existing user:<id> alert hash.
+async def build_alert_index(force: bool = False):
+    if not force and await redis_client.get(INDEX_VERSION_KEY) == INDEX_VERSION.encode():
+        return 0
+
+    indexed = 0
+    async for batch in alert_batches():
+        pipe = redis_client.pipeline(transaction=False)
+        for user_id, alerts in batch:
+            for coin_id, old_price in alerts.items():
+                index_alert(pipe, user_id, coin_id, old_price)
+                indexed += 1
+        await pipe.execute()
+
+    await redis_client.set(INDEX_VERSION_KEY, INDEX_VERSION)
+    logging.info(f"Alert index built for {indexed} alerts")
+    return indexed
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(build_alert_index(force=True))
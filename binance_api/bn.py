@@ -1,27 +1,94 @@
+import asyncio
 import os
-import requests
-import prettytable as pt
-import logging
+import time
 
+from cachetools import TTLCache
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
 
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, JobQueue, MessageHandler, filters, \
     CallbackQueryHandler
 
-from binance_api.utils import get_current_price
+from binance_api.alert_index import count_users, get_indexed_coins, find_crossed, rearm_alerts
+from binance_api.convert import DEFAULT_TARGETS, convert, format_amount, resolve_asset
+from binance_api.storage import get_alerts, add_alerts, remove_alerts, set_custom_list, get_custom_list
+from binance_api.utils import get_current_price, get_current_prices, get_price_snapshot, get_price_change, \
+    is_stream_live
 
-from tools.init import redis_client, PERCENTAGE_CHANGE
+from tools.init import RENDER_CACHE_TTL, REFRESH_THROTTLE, ALERT_ENGINE
+from tools.metrics import instrument_cycle, record_cache
+from tools.notifier import get_notifier
+from tools.singleflight import SingleFlight
+from tools.symbols import resolve_coin
+
+
+# Normalize user-supplied coins against the symbol registry, keeping unknown ones as typed
+def normalize_coins(args):
+    return [resolve_coin(coin)[0] or coin.lower() for coin in args]
+
+
+_rendered_tables = TTLCache(maxsize=1024, ttl=RENDER_CACHE_TTL)
+_render_flight = SingleFlight()
+# Last table shown on each price message, keyed by (chat_id, message_id)
+_shown_tables = TTLCache(maxsize=10000, ttl=3600)
+
+
+async def _render_price_table(coin_ids: tuple, header: bool, price_format: str, skip_missing: bool):
+    import prettytable as pt
+
+    table = pt.PrettyTable(['Symbol', 'Price', 'Change'])
+    table.border = False
+    table.header = header
+    table.padding_width = 1
+    table.align['Symbol'] = 'l'
+    table.align['Price'] = 'l'
+    table.align['Change'] = 'l'
+
+    current_prices, price_changes = await asyncio.gather(
+        get_current_prices(coin_ids),
+        asyncio.gather(*(get_price_change(coin_id, "1d") for coin_id in coin_ids)))
+    for coin_id, price_change_percent in zip(coin_ids, price_changes):
+        current_price = current_prices.get(coin_id)
+
+        if current_price is None:
+            if skip_missing:
+                continue
+            price_formatted = "0"
+            price_change_formatted = "--"
+        else:
+            price_formatted = f"${current_price:{price_format}}"
+            if price_change_percent is None:
+                price_change_formatted = "--"
+            else:
+                price_change_formatted = f"{price_change_percent:+.2f}% ✈️" if price_change_percent > 0 else f"{price_change_percent:.2f}% 🥶"
+
+        table.add_row([coin_id.upper(), price_formatted, price_change_formatted])
+
+    return f"<pre>{table.get_string()}</pre>"
+
+
+# Identical coin lists requested at the same time share one render, and the result is
+# reused for RENDER_CACHE_TTL seconds
+async def render_price_table(coin_ids: list, header: bool = True, price_format: str = ",.4f",
+                             skip_missing: bool = False):
+    key = (tuple(coin_ids), header, price_format, skip_missing)
+    text = _rendered_tables.get(key)
+    record_cache("rendered_tables", text is not None)
+    if text is None:
+        text = await _render_flight.do(key, _render_price_table, *key)
+        _rendered_tables[key] = text
+    return text
 
 
 async def list_alerts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.message.chat_id
-    user_key = f"user:{user_id}"
 
-    coins = redis_client.hgetall(user_key)
+    coins = await get_alerts(user_id)
     if not coins:
         await update.message.reply_text("You haven't set alerts for any cryptocurrencies.")
         return
 
+    import prettytable as pt
+
     table = pt.PrettyTable(['Coin', 'Price'])
     table.border = False
     table.header = False
@@ -30,8 +97,6 @@ async def list_alerts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     table.align['Price'] = 'l'
 
     for coin_id, old_price in coins.items():
-        coin_id = coin_id.decode("utf-8")
-        old_price = float(old_price)
         table.add_row([f"{coin_id.upper()}", f"{old_price:.2f} USDT"])
 
     await update.message.reply_text(f"Cryptocurrencies you've set alerts for:\n<pre>{table.get_string()}</pre>",
@@ -44,17 +109,25 @@ async def set_alert(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text("Please specify at least one cryptocurrency (coin_id).")
         return
 
-    coin_ids = [coin.lower() for coin in args]
     user_id = update.message.chat_id
+    prices = await get_price_snapshot()
 
-    for coin_id in coin_ids:
-        current_price = get_current_price(coin_id)
+    found = {}
+    messages = []
+    for coin in args:
+        coin_id, suggestion = resolve_coin(coin)
+        current_price = await get_current_price(coin_id, prices) if coin_id else None
         if current_price is None:
-            await update.message.reply_text(f"Could not find cryptocurrency {coin_id}, please check again.")
+            hint = f" Did you mean {suggestion.upper()}?" if suggestion else ""
+            messages.append(f"Could not find cryptocurrency {coin.lower()}, please check again.{hint}")
             continue
 
-        redis_client.hset(f"user:{user_id}", coin_id, current_price)
-        await update.message.reply_text(f"Price alert for {coin_id} has been set!")
+        found[coin_id] = current_price
+        messages.append(f"Price alert for {coin_id} has been set!")
+
+    if found:
+        await add_alerts(user_id, found)
+    await update.message.reply_text("\n".join(messages))
 
 
 async def remove_alert(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -65,35 +138,11 @@ async def remove_alert(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
     coin_ids = [coin.lower() for coin in args]
     user_id = update.message.chat_id
-    user_key = f"user:{user_id}"
 
-    for coin_id in coin_ids:
-        if redis_client.hexists(user_key, coin_id):
-            redis_client.hdel(user_key, coin_id)
-            await update.message.reply_text(f"Alert for {coin_id} has been removed!")
-        else:
-            await update.message.reply_text(f"No alert found for {coin_id}.")
-
-
-async def get_price_change(coin_id: str, interval: str):
-    try:
-        url = f"https://api.binance.com/api/v3/klines?symbol={coin_id.upper()}USDT&interval={interval}&limit=2"
-        response = requests.get(url)
-        response.raise_for_status()
-
-        klines = response.json()
-        if len(klines) != 2:
-            return None
-
-        old_price = float(klines[0][4])
-        # Close price of the previous kline
-        current_price = float(klines[1][4])  # Close price of the current kline
-
-        percentage_change = ((current_price - old_price) / old_price) * 100
-        return percentage_change
-    except Exception as e:
-        logging.error(f"Error fetching price change for {coin_id}: {e}")
-        return None
+    removed = await remove_alerts(user_id, coin_ids)
+    messages = [f"Alert for {coin_id} has been removed!" if coin_id in removed else f"No alert found for {coin_id}."
+                for coin_id in coin_ids]
+    await update.message.reply_text("\n".join(messages))
 
 
 async def check_price(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -104,28 +153,9 @@ async def check_price(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         await update.message.reply_text("Please specify at least one cryptocurrency (coin_id).")
         return
 
-    coin_ids = [coin.lower() for coin in args]
-
-    table = pt.PrettyTable(['Symbol', 'Price', 'Change'])
-    table.border = False
-    table.header = True
-    table.padding_width = 1
-    table.align['Symbol'] = 'l'
-    table.align['Price'] = 'l'
-    table.align['Change'] = 'l'
-
-    for coin_id in coin_ids:
-        current_price = get_current_price(coin_id)
-        price_change_percent = await get_price_change(coin_id, "1d")
+    coin_ids = normalize_coins(args)
 
-        if current_price is None:
-            price_formatted = "0"
-            price_change_formatted = "--"
-        else:
-            price_formatted = f"${current_price:,.4f}"
-            price_change_formatted = f"{price_change_percent:+.2f}% ✈️" if price_change_percent > 0 else f"{price_change_percent:.2f}% 🥶"
-
-        table.add_row([coin_id.upper(), price_formatted, price_change_formatted])
+    text = await render_price_table(coin_ids)
 
     # Add Refresh button
     keyboard = [
@@ -135,34 +165,30 @@ async def check_price(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await update.message.reply_text(f"<pre>{table.get_string()}</pre>", parse_mode="HTML", reply_markup=reply_markup,
-                                    reply_to_message_id=update.message.message_id)
+    message = await update.message.reply_text(text, parse_mode="HTML", reply_markup=reply_markup,
+                                              reply_to_message_id=update.message.message_id)
+    _shown_tables[(message.chat_id, message.message_id)] = (text, time.monotonic())
 
 
 async def refresh_prices_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query: CallbackQuery = update.callback_query
     coin_ids = query.data.split()[1:]
-    await query.answer()
+    shown_key = (query.message.chat_id, query.message.message_id)
 
-    table = pt.PrettyTable(['Symbol', 'Price', 'Change'])
-    table.border = False
-    table.header = True
-    table.padding_width = 1
-    table.align['Symbol'] = 'l'
-    table.align['Price'] = 'l'
-    table.align['Change'] = 'l'
-
-    for coin_id in coin_ids:
-        current_price = get_current_price(coin_id)
-        price_change_percent = await get_price_change(coin_id, "1d")
+    # Presses right after the last edit are answered without touching the message
+    shown_text, shown_time = _shown_tables.get(shown_key, (None, 0.0))
+    if time.monotonic() - shown_time < REFRESH_THROTTLE:
+        await query.answer("Prices are up to date.")
+        return
+    # Claim the press before rendering so simultaneous presses are throttled too
+    _shown_tables[shown_key] = (shown_text, time.monotonic())
+    await query.answer()
 
-        if current_price is None:
-            price_formatted = "0"
-            price_change_formatted = "--"
-        else:
-            price_formatted = f"${current_price:,.2f}"
-            price_change_formatted = f"{price_change_percent:+.2f}% ✈️" if price_change_percent > 0 else f"{price_change_percent:.2f}% 🥶"
-            table.add_row([coin_id.upper(), price_formatted, price_change_formatted])
+    text = await render_price_table(coin_ids, price_format=",.2f", skip_missing=True)
+    if text == shown_text:
+        # Telegram rejects edits that do not change the message
+        return
+    _shown_tables[shown_key] = (text, time.monotonic())
 
     # Add Refresh button
     keyboard = [
@@ -172,7 +198,7 @@ async def refresh_prices_callback(update: Update, context: ContextTypes.DEFAULT_
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await query.edit_message_text(f"<pre>{table.get_string()}</pre>", parse_mode="HTML", reply_markup=reply_markup)
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=reply_markup)
 
 
 async def set_custom_check(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -183,11 +209,8 @@ async def set_custom_check(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
     custom_name = args[0].lower()
     user_id = update.message.chat_id
-    custom_key = f"user:{user_id}:custom:{custom_name}"
-    logging.info("custom_key %s " % custom_key)
-    coin_ids = [coin.lower() for coin in args[1:]]
-    redis_client.delete(custom_key)
-    redis_client.sadd(custom_key, *coin_ids)
+    coin_ids = normalize_coins(args[1:])
+    await set_custom_list(user_id, custom_name, coin_ids)
 
     await update.message.reply_text(f"Custom list '{custom_name}' set with the following coins: {', '.join(coin_ids)}")
 
@@ -200,110 +223,128 @@ async def check_custom_list(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     custom_name = args[0].lower()
     user_id = update.message.chat_id
-    custom_key = f"user:{user_id}:custom:{custom_name}"
-    coin_ids = [coin.decode("utf-8") for coin in redis_client.smembers(custom_key)]
+    coin_ids = await get_custom_list(user_id, custom_name)
 
     if not coin_ids:
         await update.message.reply_text(f"No custom list found for '{custom_name}'.")
         return
 
-    table = pt.PrettyTable(['Symbol', 'Price', 'Change'])
-    table.border = False
-    table.header = False
-    table.padding_width = 1
-    table.align['Symbol'] = 'l'
-    table.align['Price'] = 'l'
-    table.align['Change'] = 'l'
+    text = await render_price_table(coin_ids, header=False, price_format=",.2f")
+    await update.message.reply_text(text, parse_mode="HTML")
 
-    for coin_id in coin_ids:
-        current_price = get_current_price(coin_id)
-        price_change_percent = await get_price_change(coin_id, "1d")
 
-        if current_price is None:
-            price_formatted = "0"
-            price_change_formatted = "--"
-        else:
-            price_formatted = f"${current_price:,.2f}"
-            price_change_formatted = f"{price_change_percent:+.2f}% ✈️" if price_change_percent > 0 else f"{price_change_percent:.2f}% 🥶"
+async def check_alerts(context: ContextTypes.DEFAULT_TYPE):
+    # While the price stream is live, alerts are evaluated on every tick instead
+    if is_stream_live():
+        return
 
-        table.add_row([coin_id.upper(), price_formatted, price_change_formatted])
+    # One bulk snapshot per cycle, shared by every user's alerts
+    coin_prices = await get_current_prices(await get_indexed_coins())
+    await evaluate_alerts(context.bot, coin_prices)
 
-    await update.message.reply_text(f"<pre>{table.get_string()}</pre>", parse_mode="HTML")
 
+async def check_alerts_on_tick(bot, prices: dict):
+    coin_prices = {}
+    for coin_id in await get_indexed_coins():
+        current_price = prices.get(f"{coin_id.upper()}USDT")
+        if current_price is not None:
+            coin_prices[coin_id] = current_price
 
-async def check_alerts(context: ContextTypes.DEFAULT_TYPE):
-    for key in redis_client.scan_iter("user:*"):
-        key_type = redis_client.type(key).decode("utf-8")
+    if coin_prices:
+        await evaluate_alerts(bot, coin_prices)
 
-        if key_type != "hash":
-            continue
 
-        user_id = int(key.decode("utf-8").split(":")[1])
-        coins = redis_client.hgetall(key)
+# Changes are missing when klines could not be fetched, e.g. with the weight budget spent
+def format_change(change):
+    return "--" if change is None else f"{change:.2f}%"
 
-        for coin_id, old_price in coins.items():
-            coin_id = coin_id.decode("utf-8")
-            old_price = float(old_price)
-            current_price = get_current_price(coin_id)
 
-            if current_price is None:
-                continue
+# Returns (users evaluated, alerts crossed, alerts fired, users notified) for the metrics
+@instrument_cycle
+async def evaluate_alerts(bot, coin_prices: dict):
+    # Only alerts whose trigger band was crossed come back from the engine or the index
+    if ALERT_ENGINE == "numpy":
+        # numpy is only loaded once the first cycle runs, not at startup
+        from binance_api.engine import get_engine
 
-            percentage_change = ((current_price - old_price) / old_price) * 100
-            if percentage_change > 0:
-                trend_icon = "💹"
-                icon = "✅"
-            else:
-                trend_icon = "💔"
-                icon = "❌"
-            if abs(percentage_change) >= PERCENTAGE_CHANGE:
-                price_change_15m = await get_price_change(coin_id, "15m")
-                price_change_4h = await get_price_change(coin_id, "4h")
-                price_change_1d = await get_price_change(coin_id, "1d")
-
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=(
-                        f"{trend_icon} <b>{coin_id.upper()}</b> has changed by {percentage_change:.2f}%\n"
-                        f"Current price: {current_price}\n"
-                        f"Change in 15 minutes: {price_change_15m:.2f}%\n"
-                        f"Change in 4 hours: {price_change_4h:.2f}%\n"
-                        f"Change in 1 day: {price_change_1d:.2f}%"
-                    ), parse_mode='HTML'
-                )
-                redis_client.hset(key, coin_id, current_price)
-
-
-# Check Value 10 BTC
+        engine = await get_engine()
+        crossed = engine.find_crossed(coin_prices)
+        users = engine.count_users(coin_prices)
+    else:
+        crossed, users = await asyncio.gather(find_crossed(coin_prices), count_users(list(coin_prices)))
+    fired = await rearm_alerts(crossed, coin_prices)
+
+    fired_coins = list({coin_id for _, coin_id, _ in fired})
+    changes = await asyncio.gather(*(asyncio.gather(
+        get_price_change(coin_id, "15m"),
+        get_price_change(coin_id, "4h"),
+        get_price_change(coin_id, "1d"),
+    ) for coin_id in fired_coins))
+    price_changes = dict(zip(fired_coins, changes))
+
+    # Every alert a user gets in this cycle goes out as a single message
+    messages = {}
+    for user_id, coin_id, old_price in fired:
+        current_price = coin_prices[coin_id]
+        percentage_change = ((current_price - old_price) / old_price) * 100
+        if percentage_change > 0:
+            trend_icon = "💹"
+            icon = "✅"
+        else:
+            trend_icon = "💔"
+            icon = "❌"
+
+        price_change_15m, price_change_4h, price_change_1d = price_changes[coin_id]
+        messages.setdefault(user_id, []).append(
+            f"{trend_icon} <b>{coin_id.upper()}</b> has changed by {percentage_change:.2f}%\n"
+            f"Current price: {current_price}\n"
+            f"Change in 15 minutes: {format_change(price_change_15m)}\n"
+            f"Change in 4 hours: {format_change(price_change_4h)}\n"
+            f"Change in 1 day: {format_change(price_change_1d)}"
+        )
+
+    notifier = get_notifier(bot)
+    for user_id, texts in messages.items():
+        await notifier.send(user_id, texts)
+
+    return users, sum(len(user_ids) for user_ids in crossed.values()), len(fired), len(messages)
+
+
+# Check Value: /value 10 btc [eth eur ...], converted over the cached cross-rate graph
 
 async def check_value(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    message_text = update.message.text.strip().lower()
+    message_text = update.message.text.strip()
     args = message_text.split()[1:]  # Split message into words and ignore the first word (command itself)
 
     if len(args) < 2:
-        await update.message.reply_text("Please specify at least one cryptocurrency (coin_id).")
+        await update.message.reply_text("Usage: /value <amount> <coin> [to ...], e.g. /value 2 eth btc eur")
         return
 
-    amount = float(args[0])
-    coin = args[1].lower()
-    if coin == 'btc':
-        btc_price = get_current_price(coin_id=coin)
-        usdt_value = amount * btc_price
-        output = (
-            f"{amount} {coin.upper()} = \n\n"
-            f"💰 {usdt_value:,.2f} USDT"
-        )
+    try:
+        amount = float(args[0].replace(",", ""))
+    except ValueError:
+        await update.message.reply_text(f"Invalid amount {args[0]}.")
+        return
 
-    else:
-        usdt_price = get_current_price(coin_id=coin)
-        btc_price = get_current_price(coin_id='btc')
-        usdt_value = amount * usdt_price
-        btc_value = usdt_value / btc_price
-        output = (
-            f"{amount} {coin.upper()} = \n\n"
-            f"💰 {usdt_value:,.2f} USDT\n"
-            f"💰 {btc_value:,.6f} BTC"
-        )
+    prices = await get_price_snapshot()
+    source, suggestion = resolve_asset(args[1], prices)
+    if source is None:
+        hint = f" Did you mean {suggestion.upper()}?" if suggestion else ""
+        await update.message.reply_text(f"Could not find cryptocurrency {args[1].lower()}, please check again.{hint}")
+        return
+
+    lines = []
+    for target_text in args[2:] or [target for target in DEFAULT_TARGETS if target != source]:
+        target, suggestion = resolve_asset(target_text, prices)
+        value = convert(amount, source, target, prices) if target else None
+        if target is None:
+            hint = f" (did you mean {suggestion.upper()}?)" if suggestion else ""
+            lines.append(f"❓ {target_text.upper()}: unknown{hint}")
+        elif value is None:
+            lines.append(f"❓ {target}: no conversion path")
+        else:
+            lines.append(f"💰 {format_amount(value)} {target}")
 
+    output = f"{amount:,.10g} {source} = \n\n" + "\n".join(lines)
     await update.message.reply_text(f"<pre>{output}</pre>", parse_mode='HTML',
                                     reply_to_message_id=update.message.message_id)
@@ -0,0 +1,166 @@
+import logging
+import struct
+import time
+from array import array
+
+from tools.http_client import get_json
+from tools.metrics import record_cache
+from tools.singleflight import SingleFlight
+from tools.init import redis_client, BINANCE_API_URL
+
+# Rolling 5m OHLC candles per symbol, fed from the price snapshots and stream ticks the bot
+# already receives, so interval changes are answered from memory instead of /klines.
+CANDLE_SECONDS = 300
+# A bit more than one day of candles, so the 1d boundary is always covered
+CANDLE_CAPACITY = 300
+# Rings not updated for this long have a gap and are backfilled again from klines
+CANDLE_STALE_AFTER = 3 * CANDLE_SECONDS
+
+INTERVAL_SECONDS = {
+    "5m": 300, "15m": 900, "30m": 1800,
+    "1h": 3600, "2h": 7200, "4h": 14400, "6h": 21600, "8h": 28800, "12h": 43200,
+    "1d": 86400,
+}
+
+_HEADER = struct.Struct("<iid")
+
+
+class CandleRing:
+    __slots__ = ("open_time", "open", "high", "low", "close", "head", "size", "updated")
+
+    def __init__(self, capacity: int = CANDLE_CAPACITY):
+        self.open_time = array("q", [0]) * capacity
+        self.open = array("d", [0.0]) * capacity
+        self.high = array("d", [0.0]) * capacity
+        self.low = array("d", [0.0]) * capacity
+        self.close = array("d", [0.0]) * capacity
+        self.head = -1
+        self.size = 0
+        self.updated = 0.0
+
+    def append(self, open_time: int, open_: float, high: float, low: float, close: float):
+        self.head = (self.head + 1) % len(self.close)
+        self.size = min(self.size + 1, len(self.close))
+        self.open_time[self.head] = open_time
+        self.open[self.head] = open_
+        self.high[self.head] = high
+        self.low[self.head] = low
+        self.close[self.head] = close
+
+    def update(self, ts: float, price: float):
+        open_time = int(ts) // CANDLE_SECONDS * CANDLE_SECONDS
+        self.updated = ts
+
+        if self.size and self.open_time[self.head] == open_time:
+            self.high[self.head] = max(self.high[self.head], price)
+            self.low[self.head] = min(self.low[self.head], price)
+            self.close[self.head] = price
+        elif not self.size or self.open_time[self.head] < open_time:
+            self.append(open_time, price, price, price, price)
+
+    # Close of the last candle that opened before the boundary, i.e. the price at the boundary
+    def close_before(self, boundary: int):
+        index = self.head
+        for _ in range(self.size):
+            if self.open_time[index] < boundary:
+                return self.close[index]
+            index = (index - 1) % len(self.close)
+        return None
+
+    def change_since(self, boundary: int):
+        if not self.size:
+            return None
+
+        old_price = self.close_before(boundary)
+        if not old_price:
+            return None
+        return ((self.close[self.head] - old_price) / old_price) * 100
+
+    def ordered(self, column: array):
+        start = (self.head - self.size + 1) % len(self.close)
+        return [column[(start + i) % len(self.close)] for i in range(self.size)]
+
+    def to_bytes(self) -> bytes:
+        columns = [array("q", self.ordered(self.open_time))]
+        columns += [array("d", self.ordered(column)) for column in (self.open, self.high, self.low, self.close)]
+        return _HEADER.pack(len(self.close), self.size, self.updated) + b"".join(c.tobytes() for c in columns)
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        capacity, size, updated = _HEADER.unpack_from(data)
+        ring = cls(capacity)
+        offset = _HEADER.size
+        columns = []
+        for typecode in "qdddd":
+            column = array(typecode)
+            column.frombytes(data[offset:offset + size * column.itemsize])
+            offset += size * column.itemsize
+            columns.append(column)
+
+        for row in zip(*columns):
+            ring.append(*row)
+        ring.updated = updated
+        return ring
+
+
+_rings = {}
+_backfills = SingleFlight()
+
+
+def record_prices(prices: dict, ts: float = None):
+    ts = time.time() if ts is None else ts
+    for symbol, ring in _rings.items():
+        price = prices.get(symbol)
+        if price is not None:
+            ring.update(ts, price)
+
+
+async def backfill(symbol: str):
+    klines = await get_json(f"{BINANCE_API_URL}/api/v3/klines",
+                            params={"symbol": symbol, "interval": "5m", "limit": CANDLE_CAPACITY})
+    ring = CandleRing()
+    for kline in klines:
+        ring.append(kline[0] // 1000, float(kline[1]), float(kline[2]), float(kline[3]), float(kline[4]))
+    ring.updated = time.time()
+    _rings[symbol] = ring
+    return ring
+
+
+# Ring for a symbol, backfilled from klines on first sight or after a gap
+async def get_ring(symbol: str):
+    ring = _rings.get(symbol)
+    if ring is not None and time.time() - ring.updated < CANDLE_STALE_AFTER:
+        record_cache("candles", True)
+        return ring
+
+    record_cache("candles", False)
+
+    # Concurrent first lookups share one klines request
+    return await _backfills.do(symbol, backfill, symbol)
+
+
+async def get_change(symbol: str, interval: str):
+    seconds = INTERVAL_SECONDS[interval]
+    ring = await get_ring(symbol)
+    boundary = int(time.time()) // seconds * seconds
+    return ring.change_since(boundary)
+
+
+async def save_candles():
+    pipe = redis_client.pipeline(transaction=False)
+    for symbol, ring in _rings.items():
+        pipe.set(f"candles:{symbol}", ring.to_bytes(), ex=2 * 86400)
+    await pipe.execute()
+
+
+async def persist_candles(context):
+    await save_candles()
+
+
+async def load_candles():
+    keys = [key async for key in redis_client.scan_iter("candles:*")]
+    if keys:
+        for key, data in zip(keys, await redis_client.mget(keys)):
+            if data:
+                _rings[key.decode("utf-8").split(":", 1)[1]] = CandleRing.from_bytes(data)
+    logging.info(f"Restored candles for {len(_rings)} symbols")
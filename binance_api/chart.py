@@ -0,0 +1,159 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from binance_api.candles import INTERVAL_SECONDS
+from tools.http_client import get_json
+from tools.init import redis_client, BINANCE_API_URL, CHART_WORKERS, CHART_CANDLES
+from tools.singleflight import SingleFlight
+from tools.symbols import resolve_coin
+
+# /chart renders a candlestick PNG with plotly in a bounded process pool, so rendering never
+# blocks the event loop. Sent images are cached as Telegram file_ids per (symbol, interval,
+# candle close time), so repeated requests within a candle are a plain re-send.
+CHART_INTERVALS = {"1m": 60, **INTERVAL_SECONDS}
+DEFAULT_INTERVAL = "1h"
+
+_pool = None
+_renders = SingleFlight()
+_render_slots = None
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+
+    if _pool is None:
+        # Forking a process that already runs threads (metrics server, HTTP client) can leave the
+        # children stuck on locks held at fork time, so they are spawned fresh
+        _pool = ProcessPoolExecutor(max_workers=CHART_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+# Runs in a pool process; plotly is only imported there
+def render_chart(symbol: str, interval: str, klines: list) -> bytes:
+    import plotly.graph_objects as go
+
+    times = [datetime.fromtimestamp(kline[0] / 1000, tz=timezone.utc) for kline in klines]
+    fig = go.Figure(data=[go.Candlestick(
+        x=times,
+        open=[float(kline[1]) for kline in klines],
+        high=[float(kline[2]) for kline in klines],
+        low=[float(kline[3]) for kline in klines],
+        close=[float(kline[4]) for kline in klines],
+    )])
+    fig.update_layout(title=f"{symbol} {interval}", template="plotly_dark", xaxis_rangeslider_visible=False,
+                      width=900, height=500, margin=dict(l=40, r=20, t=50, b=30))
+    return fig.to_image(format="png")
+
+
+def candle_close_time(interval: str, now: float = None) -> int:
+    seconds = CHART_INTERVALS[interval]
+    now = time.time() if now is None else now
+    return int(now) // seconds * seconds + seconds
+
+
+def cache_key(symbol: str, interval: str, close_time: int) -> str:
+    return f"chart:{symbol}:{interval}:{close_time}"
+
+
+async def fetch_klines(symbol: str, interval: str):
+    return await get_json(f"{BINANCE_API_URL}/api/v3/klines",
+                          params={"symbol": symbol, "interval": interval, "limit": CHART_CANDLES})
+
+
+async def render_png(symbol: str, interval: str, klines: list) -> bytes:
+    global _render_slots
+
+    # Bound the renders waiting on the pool so a burst of /chart cannot pile up work
+    if _render_slots is None:
+        _render_slots = asyncio.Semaphore(CHART_WORKERS * 2)
+    async with _render_slots:
+        return await asyncio.get_running_loop().run_in_executor(get_pool(), render_chart, symbol, interval, klines)
+
+
+async def _build_chart(symbol: str, interval: str):
+    return await render_png(symbol, interval, await fetch_klines(symbol, interval))
+
+
+async def check_chart(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    args = context.args
+    if len(args) < 1:
+        await update.message.reply_text("Please specify a cryptocurrency, e.g. /chart btc 4h.")
+        return
+
+    coin_id, suggestion = resolve_coin(args[0])
+    if coin_id is None:
+        hint = f" Did you mean {suggestion.upper()}?" if suggestion else ""
+        await update.message.reply_text(f"Could not find cryptocurrency {args[0].lower()}, please check again.{hint}")
+        return
+
+    interval = args[1].lower() if len(args) > 1 else DEFAULT_INTERVAL
+    if interval not in CHART_INTERVALS:
+        await update.message.reply_text(f"Supported intervals: {', '.join(CHART_INTERVALS)}.")
+        return
+
+    symbol = f"{coin_id.upper()}USDT"
+    close_time = candle_close_time(interval)
+    key = cache_key(symbol, interval, close_time)
+    caption = f"{symbol} {interval}"
+
+    file_id = await redis_client.get(key)
+    if file_id:
+        await update.message.reply_photo(photo=file_id.decode("utf-8"), caption=caption)
+        return
+
+    try:
+        png = await _renders.do(key, _build_chart, symbol, interval)
+    except Exception:
+        await update.message.reply_text(f"Could not render a chart for {coin_id.upper()}, please try again later.")
+        return
+
+    message = await update.message.reply_photo(photo=png, caption=caption)
+    # Keep the file_id until the candle closes; later requests re-send it without uploading
+    await redis_client.set(key, message.photo[-1].file_id, exat=close_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record klines or render a chart from recorded klines")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record")
+    record_parser.add_argument("symbol")
+    record_parser.add_argument("interval")
+    record_parser.add_argument("path")
+
+    render_parser = subparsers.add_parser("render")
+    render_parser.add_argument("path", help="klines JSON as returned by /api/v3/klines")
+    render_parser.add_argument("output")
+    render_parser.add_argument("--symbol", default="BTCUSDT")
+    render_parser.add_argument("--interval", default=DEFAULT_INTERVAL)
+
+    args = parser.parse_args()
+    if args.command == "record":
+        klines = asyncio.run(fetch_klines(args.symbol.upper(), args.interval))
+        with open(args.path, "w") as f:
+            json.dump(klines, f)
+    else:
+        with open(args.path) as f:
+            klines = json.load(f)
+        with open(args.output, "wb") as f:
+            f.write(render_chart(args.symbol.upper(), args.interval, klines))
+
+
+if __name__ == "__main__":
+    main()
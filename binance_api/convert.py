@@ -0,0 +1,125 @@
+import difflib
+from collections import deque
+
+from tools.symbols import all_binance_pairs, is_loaded, registry_updated, resolve_coin
+
+# Cross-rate conversions for /value. Every pair in the bulk ticker snapshot is an edge between
+# its base and quote asset, so any asset converts to any other over the fewest hops, e.g.
+# SOL -> BTC -> EUR. Edges only change with the registry or the set of listed symbols, so the
+# graph and its routes are cached and each conversion just reads rates from the snapshot.
+
+# Used to split symbols until the registry is loaded, longest first so FDUSD wins over USD
+KNOWN_QUOTES = sorted(("USDT", "FDUSD", "USDC", "TUSD", "BTC", "ETH", "BNB", "EUR", "TRY", "BRL", "JPY", "ARS",
+                       "PLN", "RON", "ZAR", "UAH", "MXN", "COP", "CZK", "IDR", "DAI"), key=len, reverse=True)
+# Among routes of equal length the one through the most liquid assets wins
+PREFERRED = ("USDT", "BTC", "ETH", "BNB", "FDUSD", "USDC")
+DEFAULT_TARGETS = ("USDT", "BTC")
+
+# asset -> [(neighbour, symbol, inverted), ...]
+_graph = {}
+_graph_key = None
+_routes = {}
+
+
+def split_symbol(symbol: str):
+    for quote in KNOWN_QUOTES:
+        if symbol.endswith(quote) and len(symbol) > len(quote):
+            return symbol[:-len(quote)], quote
+    return None
+
+
+def build_graph(snapshot: dict):
+    if is_loaded():
+        pairs = [(base.upper(), quote) for base, quotes in all_binance_pairs().items() for quote in quotes]
+    else:
+        pairs = [pair for pair in map(split_symbol, snapshot) if pair]
+
+    graph = {}
+    for base, quote in pairs:
+        symbol = base + quote
+        # Halted pairs are listed at a price of 0
+        if snapshot.get(symbol):
+            graph.setdefault(base, []).append((quote, symbol, False))
+            graph.setdefault(quote, []).append((base, symbol, True))
+
+    rank = {asset: i for i, asset in enumerate(PREFERRED)}
+    for edges in graph.values():
+        edges.sort(key=lambda edge: rank.get(edge[0], len(rank)))
+    return graph
+
+
+def get_graph(snapshot: dict, rebuild: bool = False):
+    global _graph, _graph_key, _routes
+
+    key = (registry_updated(), len(snapshot))
+    if rebuild or key != _graph_key:
+        _graph, _graph_key, _routes = build_graph(snapshot), key, {}
+    return _graph
+
+
+# Fewest-hop route as [(symbol, inverted), ...], or None when the assets are not connected
+def find_route(graph: dict, source: str, target: str):
+    if (source, target) in _routes:
+        return _routes[source, target]
+
+    previous = {source: None}
+    queue = deque([source])
+    while queue and target not in previous:
+        asset = queue.popleft()
+        for neighbour, symbol, inverted in graph.get(asset, ()):
+            if neighbour not in previous:
+                previous[neighbour] = (asset, symbol, inverted)
+                queue.append(neighbour)
+
+    route = None
+    if target in previous:
+        route = []
+        asset = target
+        while previous[asset] is not None:
+            asset, symbol, inverted = previous[asset]
+            route.append((symbol, inverted))
+        route.reverse()
+
+    _routes[source, target] = route
+    return route
+
+
+def convert(amount: float, source: str, target: str, snapshot: dict):
+    route = find_route(get_graph(snapshot), source, target)
+    rates = [snapshot.get(symbol) for symbol, _ in route or ()]
+    if not all(rates):
+        # A pair of the cached graph is no longer priced (halted or delisted); the rebuilt graph
+        # only has pairs this snapshot prices
+        route = find_route(get_graph(snapshot, rebuild=True), source, target)
+        rates = [snapshot.get(symbol) for symbol, _ in route or ()]
+    if route is None or not all(rates):
+        return None
+
+    value = amount
+    for (symbol, inverted), rate in zip(route, rates):
+        value = value / rate if inverted else value * rate
+    return value
+
+
+# Map user input to an asset of the graph: "btc", "bitcoin" and "EUR" all work.
+# Returns (asset, suggestion); asset is None when nothing matched.
+def resolve_asset(text: str, snapshot: dict):
+    graph = get_graph(snapshot)
+    asset = text.upper()
+    if asset in graph:
+        return asset, None
+
+    coin_id, suggestion = resolve_coin(text)
+    if coin_id and coin_id.upper() in graph:
+        return coin_id.upper(), None
+
+    matches = difflib.get_close_matches(asset, list(graph), n=1, cutoff=0.75)
+    return None, matches[0] if matches else suggestion
+
+
+def format_amount(value: float) -> str:
+    if value >= 1000:
+        return f"{value:,.2f}"
+    if value >= 1:
+        return f"{value:,.4f}"
+    return f"{value:.8f}"
@@ -0,0 +1,290 @@
+import logging
+import time
+
+import numpy as np
+
+from binance_api.alert_index import CHANGES_KEY, COINS_KEY, alert_batches, threshold_key
+from tools.init import PERCENTAGE_CHANGE, redis_client
+from tools.singleflight import SingleFlight
+
+# In-memory alert engine. Every alert is a row of columnar arrays (user, symbol, up trigger,
+# down trigger), so one cycle is a few vectorized comparisons of the price vector against the
+# rows. Rows are loaded from the user:<id> hashes once and then kept current by replaying the
+# alerts:changes stream that every index write appends to.
+#
+# Rows are also kept grouped by symbol with the lowest up and highest down trigger of each
+# group, so a cycle first compares the prices against those per-coin bounds and only scans the
+# rows of coins that crossed one. Rows added since the last grouping form an unsorted tail that
+# is always scanned in full.
+
+SYMBOL_BITS = 20
+# Regroup once this many rows were added since the last grouping
+TAIL_ROWS = 65536
+
+
+class AlertEngine:
+    def __init__(self, capacity: int = 1024):
+        self.reset(capacity)
+
+    def reset(self, capacity: int = 1024):
+        self.coins = []
+        self.coin_index = {}
+        # (user_id << SYMBOL_BITS | symbol) -> row
+        self.rows = {}
+        self.size = 0
+        self.dead = 0
+        # Live alerts per user and per symbol, for counting the users a cycle evaluates
+        self.user_alerts = {}
+        self.symbol_alerts = np.zeros(0, dtype=np.int64)
+        self.users = np.zeros(capacity, dtype=np.int64)
+        self.symbols = np.zeros(capacity, dtype=np.int32)
+        self.up = np.full(capacity, np.inf)
+        self.down = np.full(capacity, -np.inf)
+        self.last_id = None
+        # Rows [0, grouped) are listed by symbol in order[starts[s]:starts[s + 1]]
+        self.grouped = 0
+        self.order = np.zeros(0, dtype=np.int64)
+        self.starts = np.zeros(1, dtype=np.int64)
+        self.min_up = np.zeros(0)
+        self.max_down = np.zeros(0)
+
+    def __len__(self):
+        return self.size - self.dead
+
+    def symbol(self, coin_id: str) -> int:
+        index = self.coin_index.get(coin_id)
+        if index is None:
+            index = self.coin_index[coin_id] = len(self.coins)
+            self.coins.append(coin_id)
+        return index
+
+    def _grow(self, needed: int):
+        capacity = len(self.users)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+
+        extra = capacity - len(self.users)
+        self.users = np.concatenate([self.users, np.zeros(extra, dtype=np.int64)])
+        self.symbols = np.concatenate([self.symbols, np.zeros(extra, dtype=np.int32)])
+        self.up = np.concatenate([self.up, np.full(extra, np.inf)])
+        self.down = np.concatenate([self.down, np.full(extra, -np.inf)])
+
+    # Insert or update many alerts at once, from parallel lists
+    def set_many(self, user_ids: list, coin_ids: list, baselines: list, thresholds: list):
+        if not user_ids:
+            return
+
+        symbols = [self.symbol(coin_id) for coin_id in coin_ids]
+        if len(self.symbol_alerts) < len(self.coins):
+            self.symbol_alerts = np.concatenate([self.symbol_alerts,
+                                                 np.zeros(len(self.coins) - len(self.symbol_alerts), dtype=np.int64)])
+        rows = []
+        for user_id, symbol in zip(user_ids, symbols):
+            key = user_id << SYMBOL_BITS | symbol
+            row = self.rows.get(key)
+            if row is None:
+                row = self.rows[key] = self.size
+                self.size += 1
+                self.user_alerts[user_id] = self.user_alerts.get(user_id, 0) + 1
+                self.symbol_alerts[symbol] += 1
+            rows.append(row)
+        self._grow(self.size)
+
+        rows = np.array(rows, dtype=np.int64)
+        symbols = np.array(symbols, dtype=np.int32)
+        thresholds = np.array(thresholds, dtype=np.float64) / 100
+        baselines = np.array(baselines, dtype=np.float64)
+        up = baselines * (1 + thresholds)
+        down = baselines * (1 - thresholds)
+        self.users[rows] = user_ids
+        self.symbols[rows] = symbols
+        self.up[rows] = up
+        self.down[rows] = down
+
+        # Bounds of grouped rows only ever widen here; scanning a group tightens them again
+        grouped = rows < self.grouped
+        if grouped.any():
+            np.minimum.at(self.min_up, symbols[grouped], up[grouped])
+            np.maximum.at(self.max_down, symbols[grouped], down[grouped])
+
+    def remove(self, user_id: int, coin_id: str):
+        index = self.coin_index.get(coin_id)
+        row = None if index is None else self.rows.pop(user_id << SYMBOL_BITS | index, None)
+        if row is None:
+            return
+
+        self.symbol_alerts[index] -= 1
+        self.user_alerts[user_id] -= 1
+        if not self.user_alerts[user_id]:
+            del self.user_alerts[user_id]
+
+        # Dead rows can never trigger; they are dropped once they make up half the arrays
+        self.up[row] = np.inf
+        self.down[row] = -np.inf
+        self.dead += 1
+        if self.dead > self.size // 2:
+            self.compact()
+
+    def compact(self):
+        live = np.isfinite(self.up[:self.size])
+        size = int(live.sum())
+        self.users[:size] = self.users[:self.size][live]
+        self.symbols[:size] = self.symbols[:self.size][live]
+        self.up[:size] = self.up[:self.size][live]
+        self.down[:size] = self.down[:self.size][live]
+        self.up[size:self.size] = np.inf
+        self.down[size:self.size] = -np.inf
+        self.size = size
+        self.dead = 0
+
+        # Keys are built from Python ints: Telegram ids use up to 52 bits
+        self.rows = {user_id << SYMBOL_BITS | symbol: row for row, (user_id, symbol)
+                     in enumerate(zip(self.users[:size].tolist(), self.symbols[:size].tolist()))}
+        self.regroup()
+
+    def regroup(self):
+        size = self.size
+        symbols = self.symbols[:size]
+        self.order = np.argsort(symbols, kind="stable")
+        self.starts = np.searchsorted(symbols[self.order], np.arange(len(self.coins) + 1))
+        self.min_up = np.full(len(self.coins), np.inf)
+        self.max_down = np.full(len(self.coins), -np.inf)
+
+        # Segments between the starts of non-empty groups are exactly those groups
+        nonempty = np.flatnonzero(self.starts[:-1] < self.starts[1:])
+        if len(nonempty):
+            self.min_up[nonempty] = np.minimum.reduceat(self.up[self.order], self.starts[nonempty])
+            self.max_down[nonempty] = np.maximum.reduceat(self.down[self.order], self.starts[nonempty])
+        self.grouped = size
+
+    def price_vector(self, prices: dict):
+        vector = np.full(len(self.coins), np.nan)
+        for coin_id, price in prices.items():
+            index = self.coin_index.get(coin_id)
+            if index is not None:
+                vector[index] = price
+        return vector
+
+    # Rows whose trigger band the prices have left; coins without a price never trigger
+    def crossed_rows(self, vector):
+        if self.size - self.grouped > TAIL_ROWS:
+            self.regroup()
+
+        head = vector[:len(self.min_up)]
+        candidates = np.flatnonzero((head >= self.min_up) | (head <= self.max_down))
+        spans = self.starts[candidates + 1] - self.starts[candidates]
+        # When most of the market moved one pass over every row is cheaper than per-coin slices
+        if spans.sum() > self.grouped // 4:
+            return self._scan(vector, 0, self.size)
+
+        parts = [self._scan(vector, self.grouped, self.size)]
+        for symbol in candidates.tolist():
+            rows = self.order[self.starts[symbol]:self.starts[symbol + 1]]
+            up, down = self.up[rows], self.down[rows]
+            parts.append(rows[(vector[symbol] >= up) | (vector[symbol] <= down)])
+            self.min_up[symbol] = up.min()
+            self.max_down[symbol] = down.max()
+        return np.concatenate(parts)
+
+    def _scan(self, vector, start: int, end: int):
+        current = vector[self.symbols[start:end]]
+        return np.flatnonzero((current >= self.up[start:end]) | (current <= self.down[start:end])) + start
+
+    # Distinct users with an alert on one of the priced coins
+    def count_users(self, prices: dict):
+        vector = self.price_vector(prices)
+        priced = ~np.isnan(vector)
+        if priced[self.symbol_alerts > 0].all():
+            return len(self.user_alerts)
+
+        rows = np.flatnonzero(priced[self.symbols[:self.size]] & np.isfinite(self.up[:self.size]))
+        return len(np.unique(self.users[rows]))
+
+    # Same shape as alert_index.find_crossed: {coin_id: [user_id, ...]}
+    def find_crossed(self, prices: dict):
+        rows = self.crossed_rows(self.price_vector(prices))
+        crossed = {}
+        for user_id, symbol in zip(self.users[rows].tolist(), self.symbols[rows].tolist()):
+            crossed.setdefault(self.coins[symbol], []).append(user_id)
+        return crossed
+
+    async def load(self):
+        started = time.perf_counter()
+        # Take the stream position first; changes made during the scan are replayed after it
+        last = await redis_client.xrevrange(CHANGES_KEY, count=1)
+        last_id = last[0][0] if last else b"0-0"
+
+        coin_ids = [coin.decode("utf-8") for coin in await redis_client.smembers(COINS_KEY)]
+        pipe = redis_client.pipeline(transaction=False)
+        for coin_id in coin_ids:
+            pipe.hgetall(threshold_key(coin_id))
+        thresholds = {}
+        for coin_id, custom in zip(coin_ids, await pipe.execute()):
+            for user_id, threshold in custom.items():
+                thresholds[int(user_id), coin_id] = float(threshold)
+
+        user_ids, coin_ids, baselines = [], [], []
+        async for batch in alert_batches():
+            for user_id, alerts in batch:
+                for coin_id, old_price in alerts.items():
+                    user_ids.append(user_id)
+                    coin_ids.append(coin_id)
+                    baselines.append(old_price)
+
+        self.reset(max(1024, len(user_ids)))
+        self.set_many(user_ids, coin_ids, baselines,
+                      [thresholds.get((user_id, coin_id), PERCENTAGE_CHANGE)
+                       for user_id, coin_id in zip(user_ids, coin_ids)])
+        self.regroup()
+        self.last_id = last_id
+        await self.sync()
+        logging.info(f"Alert engine loaded {len(self)} alerts in {time.perf_counter() - started:.2f}s")
+
+    # Apply the changes appended since the last sync, in one round trip
+    async def sync(self):
+        if self.last_id is None:
+            return await self.load()
+
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.xrange(CHANGES_KEY, count=1)
+        pipe.xread({CHANGES_KEY: self.last_id})
+        first, entries = await pipe.execute()
+
+        # Our last position was trimmed off the stream, so changes may have been missed
+        if first and self.last_id != b"0-0" and _stream_id(first[0][0]) > _stream_id(self.last_id):
+            logging.warning("Alert engine fell behind the changes stream, reloading")
+            return await self.load()
+
+        changes = entries[0][1] if entries else []
+        user_ids, coin_ids, baselines, thresholds = [], [], [], []
+        for entry_id, fields in changes:
+            user_id, coin_id = int(fields[b"user"]), fields[b"coin"].decode("utf-8")
+            if fields[b"op"] == b"del":
+                # Flush pending sets first so a set followed by a delete ends up deleted
+                self.set_many(user_ids, coin_ids, baselines, thresholds)
+                user_ids, coin_ids, baselines, thresholds = [], [], [], []
+                self.remove(user_id, coin_id)
+            else:
+                user_ids.append(user_id)
+                coin_ids.append(coin_id)
+                baselines.append(float(fields[b"price"]))
+                thresholds.append(float(fields[b"threshold"] or PERCENTAGE_CHANGE))
+            self.last_id = entry_id
+        self.set_many(user_ids, coin_ids, baselines, thresholds)
+
+
+def _stream_id(entry_id: bytes):
+    milliseconds, sequence = entry_id.split(b"-")
+    return int(milliseconds), int(sequence)
+
+
+_engine = AlertEngine()
+_syncs = SingleFlight()
+
+
+# Synced engine for this process; concurrent cycles share one sync
+async def get_engine() -> AlertEngine:
+    await _syncs.do("sync", _engine.sync)
+    return _engine
@@ -0,0 +1,102 @@
+import heapq
+import math
+import time
+
+from binance_api.alert_index import get_indexed_coins, nearest_triggers
+from binance_api.bn import evaluate_alerts
+from binance_api.utils import get_current_prices, get_price_snapshot, is_stream_live
+from tools.init import ALERT_MIN_INTERVAL, ALERT_MAX_LATENCY
+
+# Volatility-adaptive alert scheduling. Every indexed coin has a next-check time in a
+# priority queue. After a check the coin is rescheduled from its recent volatility and the
+# relative distance to its nearest alert trigger: with per-second volatility s, a move of
+# size d takes roughly (d / s)^2 seconds, so coins near a band are checked every few
+# seconds and flat or far-away coins only every ALERT_MAX_LATENCY seconds.
+
+# Fraction of the expected time-to-trigger to wait before the next check
+SAFETY = 0.1
+# Per-second volatility assumed before a coin has been observed (about 3% a day)
+DEFAULT_VOLATILITY = 1e-4
+# Weight of the newest observation in the volatility average
+VOLATILITY_WEIGHT = 0.2
+
+
+class AlertScheduler:
+    def __init__(self):
+        self.queue = []
+        self.due = {}
+        self.last_price = {}
+        self.last_seen = {}
+        self.variance = {}
+
+    def schedule(self, coin_id: str, at: float):
+        self.due[coin_id] = at
+        heapq.heappush(self.queue, (at, coin_id))
+
+    def pop_due(self, now: float):
+        coin_ids = []
+        while self.queue and self.queue[0][0] <= now:
+            at, coin_id = heapq.heappop(self.queue)
+            # Skip entries superseded by a later schedule() call
+            if self.due.get(coin_id) == at:
+                del self.due[coin_id]
+                coin_ids.append(coin_id)
+        return coin_ids
+
+    def observe(self, coin_id: str, price: float, now: float):
+        last_price = self.last_price.get(coin_id)
+        elapsed = now - self.last_seen.get(coin_id, now)
+        if last_price and elapsed > 0:
+            variance = math.log(price / last_price) ** 2 / elapsed
+            previous = self.variance.get(coin_id, DEFAULT_VOLATILITY ** 2)
+            self.variance[coin_id] = (1 - VOLATILITY_WEIGHT) * previous + VOLATILITY_WEIGHT * variance
+        self.last_price[coin_id] = price
+        self.last_seen[coin_id] = now
+
+    def next_interval(self, coin_id: str, distance: float) -> float:
+        volatility = math.sqrt(self.variance.get(coin_id, DEFAULT_VOLATILITY ** 2)) or DEFAULT_VOLATILITY
+        interval = SAFETY * (distance / volatility) ** 2
+        return min(max(interval, ALERT_MIN_INTERVAL), ALERT_MAX_LATENCY)
+
+    # Check the coins that are due, evaluate their alerts and reschedule them.
+    # coin_filter restricts the run to the coins this process is responsible for.
+    async def run_due(self, evaluate, coin_filter=None):
+        now = time.monotonic()
+        for coin_id in await get_indexed_coins():
+            if coin_id not in self.due and (coin_filter is None or coin_filter(coin_id)):
+                self.schedule(coin_id, now)
+
+        coin_ids = [coin_id for coin_id in self.pop_due(now) if coin_filter is None or coin_filter(coin_id)]
+        if not coin_ids:
+            return
+
+        prices = await get_price_snapshot(max_age=ALERT_MIN_INTERVAL)
+        coin_prices = await get_current_prices(coin_ids, prices)
+        for coin_id in coin_ids:
+            price = coin_prices.get(coin_id)
+            if price is None:
+                self.schedule(coin_id, now + ALERT_MAX_LATENCY)
+                continue
+            self.observe(coin_id, price, now)
+
+        if not coin_prices:
+            return
+        await evaluate(coin_prices)
+
+        # Distances are taken after evaluation, so re-armed alerts count from their new baseline
+        distances = await nearest_triggers(coin_prices)
+        for coin_id in coin_prices:
+            distance = distances.get(coin_id)
+            interval = ALERT_MAX_LATENCY if distance is None else self.next_interval(coin_id, distance)
+            self.schedule(coin_id, now + interval)
+
+
+_scheduler = AlertScheduler()
+
+
+async def check_alerts_adaptive(context):
+    # While the price stream is live, alerts are evaluated on every tick instead
+    if is_stream_live():
+        return
+
+    await _scheduler.run_due(lambda coin_prices: evaluate_alerts(context.bot, coin_prices))
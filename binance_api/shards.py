@@ -0,0 +1,98 @@
+import bisect
+import logging
+import os
+import socket
+import time
+import zlib
+
+from tools.init import redis_client, ALERT_SHARDS, WORKER_TTL
+
+# Alert evaluation is split by coin into ALERT_SHARDS shards. Live workers are placed on a
+# consistent-hash ring, and a worker only evaluates a shard while it holds that shard's
+# lease in Redis, so a shard is never evaluated by two workers at once.
+WORKERS_KEY = "workers:heartbeat"
+VIRTUAL_NODES = 64
+
+ACQUIRE_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if not owner or owner == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_acquire = redis_client.register_script(ACQUIRE_SCRIPT)
+_release = redis_client.register_script(RELEASE_SCRIPT)
+
+
+def lease_key(shard: int) -> str:
+    return f"shard:lease:{shard}"
+
+
+def shard_of(coin_id: str) -> int:
+    return zlib.crc32(coin_id.encode()) % ALERT_SHARDS
+
+
+def assign_shards(worker_ids: list):
+    ring = sorted((zlib.crc32(f"{worker_id}#{i}".encode()), worker_id)
+                  for worker_id in worker_ids for i in range(VIRTUAL_NODES))
+    if not ring:
+        return {}
+
+    points = [point for point, _ in ring]
+    assignment = {}
+    for shard in range(ALERT_SHARDS):
+        index = bisect.bisect(points, zlib.crc32(f"shard:{shard}".encode())) % len(ring)
+        assignment[shard] = ring[index][1]
+    return assignment
+
+
+class ShardOwner:
+    def __init__(self, worker_id: str = None):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.owned = set()
+
+    def owns(self, coin_id: str) -> bool:
+        return shard_of(coin_id) in self.owned
+
+    # Publish a heartbeat, then acquire or renew the leases of the shards the ring assigns to
+    # this worker and release the ones it no longer should own.
+    async def heartbeat(self):
+        now = time.time()
+        pipe = redis_client.pipeline()
+        pipe.zadd(WORKERS_KEY, {self.worker_id: now})
+        pipe.zremrangebyscore(WORKERS_KEY, "-inf", now - WORKER_TTL)
+        pipe.zrange(WORKERS_KEY, 0, -1)
+        live = [worker_id.decode("utf-8") for worker_id in (await pipe.execute())[2]]
+
+        assigned = {shard for shard, worker_id in assign_shards(live).items() if worker_id == self.worker_id}
+        released = self.owned - assigned
+
+        pipe = redis_client.pipeline(transaction=False)
+        shards = sorted(assigned)
+        for shard in shards:
+            await _acquire(keys=[lease_key(shard)], args=[self.worker_id, WORKER_TTL * 1000], client=pipe)
+        for shard in released:
+            await _release(keys=[lease_key(shard)], args=[self.worker_id], client=pipe)
+        results = await pipe.execute()
+
+        owned = {shard for shard, acquired in zip(shards, results) if acquired}
+        if owned != self.owned:
+            logging.info(f"Worker {self.worker_id} owns {len(owned)}/{ALERT_SHARDS} shards ({len(live)} live workers)")
+        self.owned = owned
+
+    async def leave(self):
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zrem(WORKERS_KEY, self.worker_id)
+        for shard in self.owned:
+            await _release(keys=[lease_key(shard)], args=[self.worker_id], client=pipe)
+        await pipe.execute()
+        self.owned = set()
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from cachetools import TTLCache
+
+from tools.binance_gateway import WeightLimitExceeded
+from tools.http_client import get_json
+from tools.init import BINANCE_API_URL, BINANCE_MIRRORS, COINGECKO_API_URL, COINGECKO_FALLBACK, PRICE_SNAPSHOT_TTL, \
+    SOURCE_HEDGE_DELAY, SOURCE_FAILURE_THRESHOLD, SOURCE_COOLDOWN
+from tools.metrics import PRICE_SOURCE_OPEN, PRICE_SOURCE_HEDGES
+from tools.symbols import coingecko_id
+
+# Price sources behind the bulk snapshot. The Binance API and its mirror hosts can each serve
+# the full ticker; the healthiest one is asked first and, if it has not answered within its
+# p95 latency, the next one is asked too and the first valid answer wins. Each source has a
+# circuit breaker that skips it for SOURCE_COOLDOWN seconds after repeated failures.
+# CoinGecko simple/price fills in coins the snapshot is missing.
+
+LATENCY_SAMPLES = 100
+# Below this many samples the p95 is not trusted and SOURCE_HEDGE_DELAY is used
+MIN_SAMPLES = 10
+
+
+class PriceSource:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.error_rate = 0.0
+        self.failures = 0
+        self.open_until = 0.0
+
+    # Closed, or open with the cooldown over so one trial request may go through
+    def available(self) -> bool:
+        return time.monotonic() >= self.open_until
+
+    def p95(self) -> float:
+        if len(self.latencies) < MIN_SAMPLES:
+            return SOURCE_HEDGE_DELAY
+        return sorted(self.latencies)[int(len(self.latencies) * 0.95)]
+
+    def score(self) -> float:
+        return self.p95() * (1 + 4 * self.error_rate)
+
+    def record(self, ok: bool, latency: float = None):
+        self.error_rate = 0.9 * self.error_rate + (0.0 if ok else 0.1)
+        if ok:
+            self.latencies.append(latency)
+            self.failures = 0
+            self.open_until = 0.0
+            PRICE_SOURCE_OPEN.labels(self.name).set(0)
+            return
+
+        self.failures += 1
+        if self.failures >= SOURCE_FAILURE_THRESHOLD:
+            self.open_until = time.monotonic() + SOURCE_COOLDOWN
+            PRICE_SOURCE_OPEN.labels(self.name).set(1)
+            logging.warning(f"Price source {self.name} failed {self.failures} times, "
+                            f"skipping it for {SOURCE_COOLDOWN}s")
+
+    async def fetch(self, coin_ids: list = None) -> dict:
+        raise NotImplementedError
+
+    # fetch() with health bookkeeping; an empty answer counts as a failure
+    async def timed_fetch(self, coin_ids: list = None) -> dict:
+        start = time.monotonic()
+        try:
+            prices = await self.fetch(coin_ids)
+        except asyncio.CancelledError:
+            # Lost a hedge: it took at least this long, which is what its p95 should reflect
+            self.latencies.append(time.monotonic() - start)
+            raise
+        except WeightLimitExceeded:
+            # A spent weight budget says nothing about the source's health
+            raise
+        except Exception:
+            self.record(False)
+            raise
+        if not prices:
+            self.record(False)
+            raise ValueError(f"{self.name} returned no prices")
+        self.record(True, time.monotonic() - start)
+        return prices
+
+
+# Full ticker of one Binance host, keyed by symbol (e.g. BTCUSDT)
+class BinanceSource(PriceSource):
+    def __init__(self, name: str, base_url: str):
+        super().__init__(name)
+        self.base_url = base_url
+
+    async def fetch(self, coin_ids: list = None) -> dict:
+        tickers = await get_json(f"{self.base_url}/api/v3/ticker/price")
+        return {ticker["symbol"]: float(ticker["price"]) for ticker in tickers}
+
+
+# USD prices of the given coins, keyed like the Binance USDT pairs
+class CoinGeckoSource(PriceSource):
+    async def fetch(self, coin_ids: list = None) -> dict:
+        ids = {coingecko_id(coin_id): coin_id for coin_id in coin_ids or []}
+        ids.pop(None, None)
+        if not ids:
+            return {}
+
+        prices = await get_json(f"{COINGECKO_API_URL}/simple/price",
+                                params={"ids": ",".join(ids), "vs_currencies": "usd"})
+        return {f"{ids[gecko_id].upper()}USDT": float(price["usd"])
+                for gecko_id, price in prices.items() if gecko_id in ids and "usd" in price}
+
+
+snapshot_sources = [BinanceSource("binance", BINANCE_API_URL)] + \
+                   [BinanceSource(f"binance-mirror-{i + 1}", url) for i, url in enumerate(BINANCE_MIRRORS)]
+coingecko_source = CoinGeckoSource("coingecko")
+_fallback_cache = TTLCache(maxsize=4096, ttl=PRICE_SNAPSHOT_TTL)
+
+
+# Ask the sources in order of health, starting the next one whenever the current one is slower
+# than its p95, and return the first valid answer
+async def hedged_fetch(sources: list, coin_ids: list = None) -> dict:
+    candidates = sorted((source for source in sources if source.available()), key=PriceSource.score)
+    if not candidates:
+        # Every circuit is open: try the primary rather than serve nothing
+        candidates = sources[:1]
+
+    pending = set()
+    last_error = None
+    try:
+        for i, source in enumerate(candidates):
+            if i:
+                PRICE_SOURCE_HEDGES.labels(source.name).inc()
+            pending.add(asyncio.ensure_future(source.timed_fetch(coin_ids)))
+
+            # Wait for this source's p95, or until everything in flight has failed, before hedging
+            last = i == len(candidates) - 1
+            deadline = time.monotonic() + source.p95()
+            while pending and (last or time.monotonic() < deadline):
+                timeout = None if last else max(deadline - time.monotonic(), 0)
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+    finally:
+        # The losers are not needed any more
+        for task in pending:
+            task.cancel()
+
+    raise last_error or RuntimeError("No price source available")
+
+
+async def fetch_snapshot() -> dict:
+    return await hedged_fetch(snapshot_sources)
+
+
+# Prices of coins missing from the snapshot, looked up on CoinGecko in one request
+async def fallback_prices(coin_ids: list) -> dict:
+    prices = {coin_id: _fallback_cache[coin_id] for coin_id in coin_ids if coin_id in _fallback_cache}
+    missing = [coin_id for coin_id in coin_ids if coin_id not in prices and coingecko_id(coin_id)]
+    if not COINGECKO_FALLBACK or not missing or not coingecko_source.available():
+        return prices
+
+    try:
+        fetched = await coingecko_source.timed_fetch(missing)
+    except Exception as e:
+        logging.error(f"Error fetching fallback prices for {', '.join(missing)}: {e}")
+        return prices
+
+    for coin_id in missing:
+        price = fetched.get(f"{coin_id.upper()}USDT")
+        if price is not None:
+            prices[coin_id] = _fallback_cache[coin_id] = price
+    return prices
@@ -0,0 +1,46 @@
+from binance_api.alert_index import alerts_key, index_alert, unindex_alert
+from tools.init import redis_client
+
+# Storage API for per-user data. Every function costs one Redis round trip.
+
+
+def custom_list_key(user_id: int, name: str) -> str:
+    return f"user:{user_id}:custom:{name}"
+
+
+async def get_alerts(user_id: int):
+    coins = await redis_client.hgetall(alerts_key(user_id))
+    return {coin_id.decode("utf-8"): float(old_price) for coin_id, old_price in coins.items()}
+
+
+async def add_alerts(user_id: int, prices: dict):
+    pipe = redis_client.pipeline()
+    pipe.hset(alerts_key(user_id), mapping=prices)
+    for coin_id, price in prices.items():
+        index_alert(pipe, user_id, coin_id, price)
+    await pipe.execute()
+
+
+# Returns the coins that had an alert and were removed
+async def remove_alerts(user_id: int, coin_ids: list):
+    pipe = redis_client.pipeline()
+    positions = []
+    for coin_id in coin_ids:
+        positions.append(len(pipe))
+        pipe.hdel(alerts_key(user_id), coin_id)
+        unindex_alert(pipe, user_id, coin_id)
+    results = await pipe.execute()
+
+    return [coin_id for coin_id, position in zip(coin_ids, positions) if results[position]]
+
+
+async def set_custom_list(user_id: int, name: str, coin_ids: list):
+    key = custom_list_key(user_id, name)
+    pipe = redis_client.pipeline()
+    pipe.delete(key)
+    pipe.sadd(key, *coin_ids)
+    await pipe.execute()
+
+
+async def get_custom_list(user_id: int, name: str):
+    return [coin.decode("utf-8") for coin in await redis_client.smembers(custom_list_key(user_id, name))]
@@ -0,0 +1,61 @@
+import asyncio
+import json
+import logging
+
+import websockets
+
+from binance_api.utils import get_price_snapshot, update_price_snapshot
+from tools.init import BINANCE_WS_URL, STREAM_SYMBOLS
+
+
+def get_stream_url():
+    if not STREAM_SYMBOLS:
+        return f"{BINANCE_WS_URL}/ws/!miniTicker@arr"
+
+    streams = "/".join(f"{coin}usdt@miniTicker" for coin in STREAM_SYMBOLS)
+    return f"{BINANCE_WS_URL}/stream?streams={streams}"
+
+
+# Turn one miniTicker frame (array, single event or combined-stream envelope) into {symbol: close}
+def parse_frame(frame):
+    if isinstance(frame, dict) and "data" in frame:
+        frame = frame["data"]
+    if isinstance(frame, dict):
+        frame = [frame]
+
+    return {ticker["s"]: float(ticker["c"]) for ticker in frame if ticker.get("e") == "24hrMiniTicker"}
+
+
+# Keep the latest-price table fed from the WebSocket, reconnecting with backoff.
+# on_tick is awaited with the {symbol: price} changes of every frame.
+async def run_stream(on_tick=None):
+    url = get_stream_url()
+    backoff = 1
+
+    # Seed the table over REST; miniTicker frames only carry symbols that changed
+    await get_price_snapshot()
+
+    while True:
+        try:
+            async with websockets.connect(url, ping_interval=20, max_size=None) as ws:
+                logging.info(f"Price stream connected to {url}")
+                backoff = 1
+
+                async for message in ws:
+                    prices = parse_frame(json.loads(message))
+                    if not prices:
+                        continue
+
+                    update_price_snapshot(prices, complete=not STREAM_SYMBOLS)
+                    if on_tick is not None:
+                        try:
+                            await on_tick(prices)
+                        except Exception as e:
+                            logging.error(f"Error handling price tick: {e}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Price stream disconnected: {e}, reconnecting in {backoff}s")
+
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, 60)
@@ -1,15 +1,136 @@
-import requests
+import asyncio
+import json
+import time
+
 import logging
 
+from binance_api.candles import get_change, record_prices
+from binance_api.sources import fallback_prices, fetch_snapshot
+from tools.binance_gateway import WeightLimitExceeded
+from tools.metrics import record_cache
+from tools.symbols import is_listed
+from tools.init import PRICE_SNAPSHOT_TTL, STREAM_STALE_AFTER, redis_client
 
-def get_current_price(coin_id: str):
-    try:
-        url = f"https://api.binance.com/api/v3/ticker/price?symbol={coin_id.upper()}USDT"
-        response = requests.get(url)
-        response.raise_for_status()
+SNAPSHOT_KEY = "prices:snapshot"
+# Latest bulk ticker snapshot, keyed by Binance symbol (e.g. BTCUSDT)
+_price_snapshot = {}
+_price_snapshot_time = 0.0
+_price_snapshot_lock = None
+# Last time the stream delivered a full-market tick; REST polling resumes once it goes stale
+_last_stream_tick = 0.0
+
+
+async def get_price_snapshot(max_age: float = PRICE_SNAPSHOT_TTL):
+    global _price_snapshot, _price_snapshot_time, _price_snapshot_lock
+
+    if _price_snapshot and time.monotonic() - _price_snapshot_time < max_age:
+        record_cache("price_snapshot", True)
+        return _price_snapshot
+
+    record_cache("price_snapshot", False)
+    if _price_snapshot_lock is None:
+        _price_snapshot_lock = asyncio.Lock()
+    async with _price_snapshot_lock:
+        # Another task may have refreshed the snapshot while we were waiting
+        if _price_snapshot and time.monotonic() - _price_snapshot_time < max_age:
+            return _price_snapshot
+
+        try:
+            _price_snapshot = await fetch_snapshot()
+            _price_snapshot_time = time.monotonic()
+            record_prices(_price_snapshot)
+        except WeightLimitExceeded as e:
+            # Over the Binance weight budget the previous snapshot is good enough
+            logging.warning(f"Serving the cached price snapshot: {e}")
+        except Exception as e:
+            # Keep serving the previous snapshot rather than failing every lookup
+            logging.error(f"Error fetching price snapshot: {e}")
+
+    return _price_snapshot
+
+
+# Force the next lookup to fetch a new snapshot
+def expire_price_snapshot():
+    global _price_snapshot_time
+
+    _price_snapshot_time = 0.0
+
+
+# Share the snapshot with the next process to start, which serves it until its first fetch
+async def save_price_snapshot():
+    if not _price_snapshot:
+        return
+
+    fetched_at = time.time() - (time.monotonic() - _price_snapshot_time)
+    await redis_client.set(SNAPSHOT_KEY, json.dumps({"time": fetched_at, "prices": _price_snapshot}), ex=3600)
+
+
+async def persist_price_snapshot(context):
+    await save_price_snapshot()
+
+
+# Restore the last saved snapshot with its real age, so it is refetched as usual once too old
+async def load_price_snapshot():
+    global _price_snapshot, _price_snapshot_time
 
-        ticker = response.json()
-        return float(ticker["price"])
+    data = await redis_client.get(SNAPSHOT_KEY)
+    if data is None or _price_snapshot:
+        return
+
+    saved = json.loads(data)
+    age = max(time.time() - saved["time"], 0)
+    _price_snapshot = saved["prices"]
+    _price_snapshot_time = time.monotonic() - age
+    logging.info(f"Restored {len(_price_snapshot)} prices from a snapshot {age:.0f}s old")
+
+
+def is_stream_live():
+    return time.monotonic() - _last_stream_tick < STREAM_STALE_AFTER
+
+
+# Merge streamed ticks into the snapshot. A live stream covering every symbol keeps the
+# snapshot fresh so REST is not polled; a per-symbol stream only overlays its coins and
+# leaves the REST cycles running for every other coin.
+def update_price_snapshot(prices: dict, complete: bool = True):
+    global _price_snapshot_time, _last_stream_tick
+
+    _price_snapshot.update(prices)
+    record_prices(prices)
+    if complete:
+        _last_stream_tick = _price_snapshot_time = time.monotonic()
+
+
+# {coin_id: USDT price} for the coins found in the snapshot or, failing that, on CoinGecko
+async def get_current_prices(coin_ids: list, snapshot: dict = None):
+    if snapshot is None:
+        snapshot = await get_price_snapshot()
+
+    prices = {}
+    for coin_id in coin_ids:
+        price = snapshot.get(f"{coin_id.upper()}USDT")
+        if price is not None:
+            prices[coin_id] = price
+
+    missing = [coin_id for coin_id in coin_ids if coin_id not in prices]
+    if missing:
+        prices.update(await fallback_prices(missing))
+    return prices
+
+
+async def get_current_price(coin_id: str, snapshot: dict = None):
+    price = (await get_current_prices([coin_id], snapshot)).get(coin_id)
+    if price is None:
+        logging.error(f"Error fetching price for {coin_id}: symbol not found")
+    return price
+
+
+async def get_price_change(coin_id: str, interval: str):
+    # Unlisted pairs are rejected locally instead of costing a failed klines request
+    if not is_listed(coin_id):
+        return None
+
+    try:
+        return await get_change(f"{coin_id.upper()}USDT", interval)
     except Exception as e:
-        logging.error(f"Error fetching price for {coin_id}: {e}")
+        logging.error(f"Error fetching price change for {coin_id}: {e}")
         return None
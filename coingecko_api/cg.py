@@ -1,34 +1,59 @@
+import html
 from datetime import datetime
 
-import requests
 from telegram import Update
 from telegram.ext import CallbackContext, ContextTypes
-import prettytable as pt
-from cachetools import cached, TTLCache
-from pycoingecko import CoinGeckoAPI
-from .utils import format_number
+from tools.cache import SharedCache
+from tools.http_client import get_json
+from tools.init import COINGECKO_API_URL, TRENDING_CACHE_TTL, COIN_INFO_CACHE_TTL, CACHE_STALE_TTL
+from tools.symbols import coingecko_id
+from .utils import format_number, format_percent
 
-cg = CoinGeckoAPI()
+_trending_cache = SharedCache("trending", TRENDING_CACHE_TTL, CACHE_STALE_TTL, maxsize=1)
+_coin_info_cache = SharedCache("coin_info", COIN_INFO_CACHE_TTL, CACHE_STALE_TTL)
 
+# Fields of /coins/{id} market_data that check_coin_info renders, in USD where quoted per currency
+COIN_MARKET_FIELDS = ("current_price", "market_cap", "low_24h", "high_24h", "total_volume", "ath", "atl",
+                      "ath_date", "atl_date", "ath_change_percentage", "atl_change_percentage")
+COIN_PLAIN_FIELDS = ("price_change_percentage_24h", "price_change_percentage_7d", "price_change_percentage_30d",
+                     "circulating_supply", "max_supply")
 
-@cached(cache=TTLCache(maxsize=100000, ttl=60))
-def get_trending_coins():
-    url = "https://api.coingecko.com/api/v3/search/trending"
-    response = requests.get(url)
 
-    if response.status_code == 200:
-        return response.json()["coins"]
-    else:
+# Keep only what check_trending renders
+async def fetch_trending_coins():
+    coins = (await get_json(f"{COINGECKO_API_URL}/search/trending"))["coins"]
+    return [{"market_cap_rank": coin["item"]["market_cap_rank"], "symbol": coin["item"]["symbol"],
+             "name": coin["item"]["name"]} for coin in coins]
+
+
+async def get_trending_coins():
+    try:
+        return await _trending_cache.get("coins", fetch_trending_coins)
+    except Exception:
         return None
 
 
+# Keep only what check_coin_info renders instead of the full coin JSON
+async def fetch_coin_info(coin_id: str):
+    coin_data = await get_json(f"{COINGECKO_API_URL}/coins/{coin_id}",
+                               params={"localization": "false", "tickers": "false", "market_data": "true",
+                                       "community_data": "false", "developer_data": "false"})
+    market_data = coin_data["market_data"]
+    coin_info = {"name": coin_data["name"], "market_cap_rank": coin_data["market_cap_rank"]}
+    coin_info.update({field: market_data[field]["usd"] for field in COIN_MARKET_FIELDS})
+    coin_info.update({field: market_data[field] for field in COIN_PLAIN_FIELDS})
+    return coin_info
+
+
 async def check_trending(update: Update, context: CallbackContext) -> None:
-    trending_coins = get_trending_coins()
+    trending_coins = await get_trending_coins()
 
     if trending_coins is None:
         await update.message.reply_text("Failed to get trending coins. Please try again later.")
         return
 
+    import prettytable as pt
+
     table = pt.PrettyTable(['No', 'Rank', 'Symbol', 'Name'])
     table.border = False
     table.header = True
@@ -40,11 +65,11 @@ async def check_trending(update: Update, context: CallbackContext) -> None:
     counter = 1
 
     for coin in trending_coins:
-        rank = coin["item"]["market_cap_rank"]
+        rank = coin["market_cap_rank"]
         if not rank:
             rank = "--"
-        symbol = coin["item"]["symbol"].upper()
-        name = coin["item"]["name"]
+        symbol = coin["symbol"].upper()
+        name = coin["name"]
         num = f"#{counter}"
         table.add_row([num, rank, symbol, name])
         counter += 1
@@ -55,32 +80,14 @@ async def check_trending(update: Update, context: CallbackContext) -> None:
     await update.message.reply_text(message, parse_mode="HTML")
 
 
-@cached(cache=TTLCache(maxsize=1000000, ttl=60 * 3600))
-def get_coin_list():
-    response = requests.get(f'https://api.coingecko.com/api/v3/coins/list')
-    response.raise_for_status()
-    coins = response.json()
-    redis_client.set(redis_key, json.dumps(coins))
-    return coins
-
-
-def get_coin_info(coin_symbol):
+async def get_coin_info(coin_symbol):
     try:
-
-        coins = get_coin_list()
-
-        coin_id = None
-        for coin in coins:
-            if coin['symbol'].lower() == coin_symbol.lower():
-                coin_id = coin['id']
-                break
+        coin_id = coingecko_id(coin_symbol)
         if coin_id is None:
             print(f'Error: Coin not found with symbol {coin_symbol}')
             return None
 
-        coin_data = cg.get_coin_by_id(id=coin_id, localization=False, tickers=False, market_data=True,
-                                      community_data=False, developer_data=False)
-        return coin_data
+        return await _coin_info_cache.get(coin_id, fetch_coin_info, coin_id)
     except Exception as e:
         print(f"Error getting coin info for '{coin_symbol}': {e}")
         return None
@@ -96,48 +103,48 @@ async def check_coin_info(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     coin_symbol = args[0]
 
-    coin_info = get_coin_info(coin_symbol)
+    coin_info = await get_coin_info(coin_symbol)
     if coin_info is None:
         await update.message.reply_text(f"Coin not found with symbol {coin_symbol}.")
         return
 
     coin_name = coin_info['name']
     coin_rank = coin_info['market_cap_rank']
-    current_price = coin_info['market_data']['current_price']['usd']
-    market_cap = coin_info['market_data']['market_cap']['usd']
-    low_24h = coin_info['market_data']['low_24h']['usd']
-    high_24h = coin_info['market_data']['high_24h']['usd']
-    volume_24h = coin_info['market_data']['total_volume']['usd']
-    price_change_24h = coin_info['market_data']['price_change_percentage_24h']
-    price_change_7d = coin_info['market_data']['price_change_percentage_7d']
-    price_change_30d = coin_info['market_data']['price_change_percentage_30d']
-    ath = coin_info['market_data']['ath']['usd']
-    atl = coin_info['market_data']['atl']['usd']
-
-    atl_date_str = coin_info['market_data']['atl_date']['usd']
+    current_price = coin_info['current_price']
+    market_cap = coin_info['market_cap']
+    low_24h = coin_info['low_24h']
+    high_24h = coin_info['high_24h']
+    volume_24h = coin_info['total_volume']
+    price_change_24h = coin_info['price_change_percentage_24h']
+    price_change_7d = coin_info['price_change_percentage_7d']
+    price_change_30d = coin_info['price_change_percentage_30d']
+    ath = coin_info['ath']
+    atl = coin_info['atl']
+
+    atl_date_str = coin_info['atl_date']
     atl_date = datetime.strptime(atl_date_str, '%Y-%m-%dT%H:%M:%S.%fZ')
-    ath_date_str = coin_info['market_data']['ath_date']['usd']
+    ath_date_str = coin_info['ath_date']
     ath_date = datetime.strptime(ath_date_str, '%Y-%m-%dT%H:%M:%S.%fZ')
 
-    ath_change = coin_info['market_data']['ath_change_percentage']['usd']
-    atl_change = coin_info['market_data']['atl_change_percentage']['usd']
-    circulating_supply = coin_info['market_data']['circulating_supply']
-    max_supply = coin_info['market_data']['max_supply']
+    ath_change = coin_info['ath_change_percentage']
+    atl_change = coin_info['atl_change_percentage']
+    circulating_supply = coin_info['circulating_supply']
+    max_supply = coin_info['max_supply']
 
+    # Telegram's HTML mode only allows a few tags, so the card is plain lines inside <pre>
     output = (
-        f"<p>💰 {coin_name} 💰 #{coin_rank}</p>"
-        f"<ul>"
-        f"<li>Price: {current_price:,.2f} $</li>"
-        f"<li>Mkt Cap: {format_number(market_cap)} $</li>"
-        f"<li>24h: ↑{high_24h:,.2f} $, ↓{low_24h:,.2f} $</li>"
-        f"<li>24h Vol: {format_number(volume_24h)} $</li>"
-        f"<li>24h Chg: {price_change_24h:+.2f}%</li>"
-        f"<li>7d/30d Chg: {price_change_7d:+.2f}% / {price_change_30d:+.2f}%</li>"
-        f"<li>ATH: {ath:,.2f} $ ({ath_date.strftime('%Y-%m-%d')})</li>"
-        f"<li>ATL: {atl:,.6f} $ ({atl_date.strftime('%Y-%m-%d')})</li>"
-        f"<li>ATH/ATL %: ➗{ath_change:.1f} / ❎{atl_change:.1f}</li>"
-        f"<li>Supply: {circulating_supply:,.2f} M / {max_supply:,.2f} M</li>"
-        f"</ul>"
+        f"💰 {html.escape(coin_name)} 💰 #{coin_rank or '--'}\n"
+        f"Price: {current_price:,.2f} $\n"
+        f"Mkt Cap: {format_number(market_cap)} $\n"
+        f"24h: ↑{high_24h:,.2f} $, ↓{low_24h:,.2f} $\n"
+        f"24h Vol: {format_number(volume_24h)} $\n"
+        f"24h Chg: {format_percent(price_change_24h)}\n"
+        f"7d/30d Chg: {format_percent(price_change_7d)} / {format_percent(price_change_30d)}\n"
+        f"ATH: {ath:,.2f} $ ({ath_date.strftime('%Y-%m-%d')})\n"
+        f"ATL: {atl:,.6f} $ ({atl_date.strftime('%Y-%m-%d')})\n"
+        f"ATH/ATL %: ➗{ath_change:.1f} / ❎{atl_change:.1f}\n"
+        f"Supply: {format_number(circulating_supply)} / "
+        f"{'∞' if max_supply is None else format_number(max_supply)}"
     )
 
     await update.message.reply_text(f"<pre>{output}</pre>", parse_mode="HTML")
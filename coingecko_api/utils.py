@@ -5,3 +5,8 @@ def format_number(n: float) -> str:
         magnitude += 1
         n /= 1000.0
     return f"{n:,.2f} {symbols[magnitude]}"
+
+
+# New coins have no history yet, so their changes are missing
+def format_percent(value) -> str:
+    return "--" if value is None else f"{value:+.2f}%"
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from bench.run import use_fake_redis
+from binance_api import alert_index
+from binance_api.alert_index import build_alert_index, get_indexed_coins, rearm_alerts, up_key
+from binance_api.storage import add_alerts, remove_alerts
+from tools.init import redis_client
+
+
+@pytest.fixture(autouse=True)
+def fake_redis():
+    use_fake_redis(redis_client)
+
+
+def test_coin_leaves_index_with_its_last_alert():
+    async def run():
+        await add_alerts(1, {"eth": 100.0, "btc": 50000.0})
+        await add_alerts(2, {"eth": 100.0})
+
+        assert await remove_alerts(1, ["eth"]) == ["eth"]
+        assert sorted(await get_indexed_coins()) == ["btc", "eth"]
+
+        await remove_alerts(2, ["eth"])
+        assert await get_indexed_coins() == ["btc"]
+
+    asyncio.run(run())
+
+
+def test_rearm_of_a_removed_alert_drops_its_coin():
+    async def run():
+        await add_alerts(1, {"sol": 100.0})
+        # The hash entry is gone but the index still has it, as after a crash between the two
+        await redis_client.hdel("user:1", "sol")
+        assert await rearm_alerts({"sol": [1]}, {"sol": 200.0}) == []
+        assert await get_indexed_coins() == []
+
+    asyncio.run(run())
+
+
+def test_build_alert_index_reads_in_batches(monkeypatch):
+    monkeypatch.setattr(alert_index, "SCAN_BATCH", 3)
+
+    async def run():
+        for user_id in range(1, 8):
+            await redis_client.hset(f"user:{user_id}", mapping={"eth": 100.0, "btc": 50000.0})
+        await redis_client.sadd("user:1:custom:majors", "btc")
+
+        assert await build_alert_index(force=True) == 14
+        assert sorted(await get_indexed_coins()) == ["btc", "eth"]
+        assert await redis_client.zcard(up_key("eth")) == 7
+
+    asyncio.run(run())
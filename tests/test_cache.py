@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+from bench.run import use_fake_redis
+from tools.cache import SharedCache
+from tools.init import redis_client
+
+
+@pytest.fixture(autouse=True)
+def fake_redis():
+    use_fake_redis(redis_client)
+
+
+def test_miss_during_a_refresh_waits_for_the_value():
+    cache = SharedCache("test", ttl=60, stale_ttl=60)
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        return "loaded here"
+
+    # Another process holds the lock and stores the value a moment later
+    async def other_process():
+        await asyncio.sleep(0.3)
+        await SharedCache("test", ttl=60, stale_ttl=60)._write("trending", "loaded elsewhere")
+
+    async def run():
+        await redis_client.set(cache.lock_key("trending"), "other")
+        cache._refresh_later("trending", loader)
+        value, _ = await asyncio.gather(cache.get("trending", loader), other_process())
+        return value
+
+    assert asyncio.run(run()) == "loaded elsewhere"
+    assert calls == []
@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+from bench.run import use_fake_redis
+from binance_api import alert_index
+from binance_api.alert_index import index_alert
+from binance_api.engine import AlertEngine
+from tools.init import redis_client, PERCENTAGE_CHANGE
+
+
+@pytest.fixture(autouse=True)
+def fake_redis():
+    use_fake_redis(redis_client)
+
+
+def test_load_reads_alerts_and_custom_thresholds_in_batches(monkeypatch):
+    monkeypatch.setattr(alert_index, "SCAN_BATCH", 3)
+
+    async def run():
+        pipe = redis_client.pipeline()
+        for user_id in range(1, 8):
+            pipe.hset(f"user:{user_id}", "eth", 100.0)
+            index_alert(pipe, user_id, "eth", 100.0, threshold=1.0 if user_id == 7 else None)
+        await pipe.execute()
+
+        engine = AlertEngine()
+        await engine.load()
+        assert len(engine) == 7
+
+        # Only the custom 1% band is crossed by a move smaller than the default threshold
+        moved = 100.0 * (1 + PERCENTAGE_CHANGE / 200)
+        assert engine.find_crossed({"eth": moved}) == {"eth": [7]}
+        assert sorted(engine.find_crossed({"eth": 100.0 * (1 + PERCENTAGE_CHANGE / 100)})["eth"]) == list(range(1, 8))
+
+    asyncio.run(run())
@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+import pytest
+from prometheus_client import REGISTRY
+
+from bench.run import use_fake_redis
+from binance_api import alert_index
+from binance_api.engine import AlertEngine
+from binance_api.storage import add_alerts, remove_alerts
+from tools.binance_gateway import WeightLimitExceeded, budget
+from tools.http_client import get_json
+from tools.init import BINANCE_API_URL, redis_client
+
+
+@pytest.fixture(autouse=True)
+def fake_redis():
+    use_fake_redis(redis_client)
+
+
+def upstream_count(status: str) -> float:
+    return REGISTRY.get_sample_value("bot_upstream_requests_total", {"endpoint": "ticker", "status": status}) or 0
+
+
+def test_engine_counts_users_with_priced_alerts():
+    engine = AlertEngine()
+    engine.set_many([1, 1, 2, 3], ["eth", "btc", "eth", "sol"], [100.0, 50000.0, 100.0, 20.0], [3, 3, 3, 3])
+
+    assert engine.count_users({"eth": 100.0, "btc": 50000.0, "sol": 20.0}) == 3
+    assert engine.count_users({"eth": 100.0}) == 2
+    assert engine.count_users({"btc": 50000.0}) == 1
+
+    engine.remove(3, "sol")
+    assert engine.count_users({"eth": 100.0, "btc": 50000.0}) == 2
+    engine.remove(2, "eth")
+    assert engine.count_users({"eth": 100.0}) == 1
+
+
+def test_redis_index_counts_users_with_priced_alerts():
+    async def run():
+        await add_alerts(1, {"eth": 100.0, "btc": 50000.0})
+        await add_alerts(2, {"eth": 100.0})
+        await add_alerts(3, {"sol": 20.0})
+
+        assert await alert_index.count_users(["eth", "btc"]) == 2
+        assert await alert_index.count_users(["eth", "btc", "sol"]) == 3
+        await remove_alerts(1, ["eth", "btc"])
+        assert await alert_index.count_users(["eth", "btc"]) == 1
+        assert await alert_index.count_users([]) == 0
+
+    asyncio.run(run())
+
+
+def test_budget_rejections_are_not_upstream_errors(monkeypatch):
+    monkeypatch.setattr(budget, "paused_until", time.time() + 60)
+    errors, rejected = upstream_count("error"), upstream_count("rejected")
+
+    with pytest.raises(WeightLimitExceeded):
+        asyncio.run(get_json(f"{BINANCE_API_URL}/api/v3/ticker/price"))
+
+    assert upstream_count("error") == errors
+    assert upstream_count("rejected") == rejected + 1
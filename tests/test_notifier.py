@@ -0,0 +1,84 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from bench.run import use_fake_redis
+from tools import notifier as notifier_module
+from tools.init import redis_client
+from tools.notifier import BACKLOG_PREFIX, OWNERS_KEY, Notifier, split_message
+
+
+class RecordingBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id: int, text: str, parse_mode: str):
+        self.sent.append((chat_id, text))
+
+
+@pytest.fixture(autouse=True)
+def fake_redis():
+    use_fake_redis(redis_client)
+
+
+def backlog_entry(chat_id: int, text: str, created: float = None):
+    return json.dumps({"chat_id": chat_id, "text": text, "parse_mode": "HTML",
+                       "created": created or time.time(), "attempts": 0})
+
+
+def test_dead_owner_backlog_is_claimed_once():
+    async def run():
+        await redis_client.zadd(OWNERS_KEY, {"dead": time.time() - 100, "live": time.time()})
+        await redis_client.hset(BACKLOG_PREFIX + "dead", mapping={"m0": backlog_entry(1, "a"),
+                                                                  "m1": backlog_entry(1, "b")})
+        await redis_client.hset(BACKLOG_PREFIX + "live", "m2", backlog_entry(2, "c"))
+
+        first, second = Notifier(RecordingBot()), Notifier(RecordingBot())
+        await asyncio.gather(first.start(), second.start())
+        await asyncio.gather(first.drain(), second.drain())
+        await first.stop()
+        await second.stop()
+
+        sent = sorted(first.bot.sent + second.bot.sent)
+        assert sent == [(1, "a"), (1, "b")]
+        assert await redis_client.exists(BACKLOG_PREFIX + "dead") == 0
+        assert await redis_client.hlen(BACKLOG_PREFIX + "live") == 1
+
+    asyncio.run(run())
+
+
+def test_stalled_owner_skips_claimed_messages():
+    async def run():
+        stalled = Notifier(RecordingBot())
+        await stalled._renew()
+        await stalled.send(1, ["taken"])
+
+        # The owner stops heartbeating past WORKER_TTL and a peer takes its backlog
+        await redis_client.zadd(OWNERS_KEY, {stalled.owner_id: time.time() - notifier_module.WORKER_TTL - 1})
+        stalled.lease_until = time.monotonic() - 1
+        peer = Notifier(RecordingBot())
+        await peer.start()
+        await peer.drain()
+
+        # Sent after the claim, so still this owner's to deliver
+        await stalled.send(1, ["fresh"])
+        await stalled.start()
+        await stalled.drain()
+        await stalled.stop()
+        await peer.stop()
+
+        assert peer.bot.sent == [(1, "taken")]
+        assert stalled.bot.sent == [(1, "fresh")]
+
+    asyncio.run(run())
+
+
+def test_split_message_keeps_alerts_whole():
+    chunks = split_message(["x" * 3000, "y" * 3000, "z" * 100])
+    assert chunks == ["x" * 3000, "y" * 3000 + "\n\n" + "z" * 100]
+
+    chunks = split_message(["head", "\n".join(["w" * 100] * 100)])
+    assert all(len(chunk) <= notifier_module.MESSAGE_LIMIT for chunk in chunks)
+    assert chunks[0].startswith("head\n\n")
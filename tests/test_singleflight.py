@@ -0,0 +1,76 @@
+import asyncio
+
+from binance_api import utils
+from tools.binance_gateway import BACKGROUND, INTERACTIVE, WeightLimitExceeded, background, get_priority
+from tools.singleflight import SingleFlight
+
+
+# Stands in for a Binance request: the budget refuses background work and serves interactive
+async def budgeted_fetch(calls: list):
+    calls.append(get_priority())
+    await asyncio.sleep(0.01)
+    if get_priority() == BACKGROUND:
+        raise WeightLimitExceeded("budget spent")
+    return "prices"
+
+
+def test_interactive_caller_retries_a_refused_background_flight():
+    flight = SingleFlight()
+    calls = []
+
+    @background
+    async def background_caller():
+        return await flight.do("key", budgeted_fetch, calls)
+
+    async def interactive_caller():
+        await asyncio.sleep(0)
+        return await flight.do("key", budgeted_fetch, calls)
+
+    async def run():
+        return await asyncio.gather(background_caller(), interactive_caller(), return_exceptions=True)
+
+    refused, answer = asyncio.run(run())
+    assert isinstance(refused, WeightLimitExceeded)
+    assert answer == "prices"
+    assert calls == [BACKGROUND, INTERACTIVE]
+    assert flight.calls == {}
+
+
+def test_background_callers_share_the_refusal():
+    flight = SingleFlight()
+    calls = []
+
+    @background
+    async def background_caller():
+        return await flight.do("key", budgeted_fetch, calls)
+
+    async def run():
+        return await asyncio.gather(background_caller(), background_caller(), return_exceptions=True)
+
+    assert all(isinstance(result, WeightLimitExceeded) for result in asyncio.run(run()))
+    assert calls == [BACKGROUND]
+
+
+def test_interactive_snapshot_waiter_fetches_after_a_refused_background_fetch(monkeypatch):
+    calls = []
+    monkeypatch.setattr(utils, "fetch_snapshot", lambda: budgeted_fetch(calls))
+    monkeypatch.setattr(utils, "record_prices", lambda prices: None)
+    monkeypatch.setattr(utils, "_price_snapshot", {"BTCUSDT": 1.0})
+    monkeypatch.setattr(utils, "_price_snapshot_time", 0.0)
+    monkeypatch.setattr(utils, "_price_snapshot_lock", None)
+
+    @background
+    async def background_caller():
+        return await utils.get_price_snapshot()
+
+    async def interactive_caller():
+        await asyncio.sleep(0)
+        return await utils.get_price_snapshot()
+
+    async def run():
+        return await asyncio.gather(background_caller(), interactive_caller())
+
+    stale, fresh = asyncio.run(run())
+    assert stale == {"BTCUSDT": 1.0}
+    assert fresh == "prices"
+    assert calls == [BACKGROUND, INTERACTIVE]
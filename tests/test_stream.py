@@ -0,0 +1,67 @@
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+# Configuration is read at import time, so stream only BTC before the bot modules load
+os.environ.update({"STREAM_SYMBOLS": "btc", "PERCENTAGE_CHANGE": "3", "COINGECKO_FALLBACK": "false"})
+
+import pytest
+
+from bench.run import use_fake_redis
+from binance_api import bn, scheduler, utils
+from binance_api.storage import add_alerts
+from tools.init import redis_client
+
+
+class RecordingNotifier:
+    def __init__(self):
+        self.sent = {}
+
+    async def send(self, chat_id: int, texts: list, parse_mode: str = "HTML"):
+        self.sent.setdefault(chat_id, []).extend(texts)
+
+
+@pytest.fixture
+def notifier(monkeypatch):
+    use_fake_redis(redis_client)
+    notifier = RecordingNotifier()
+    monkeypatch.setattr(bn, "get_notifier", lambda bot: notifier)
+    monkeypatch.setattr(bn, "get_price_change", lambda coin_id, interval: asyncio.sleep(0))
+    monkeypatch.setattr(utils, "_price_snapshot", {})
+    monkeypatch.setattr(utils, "_last_stream_tick", 0.0)
+    return notifier
+
+
+# Alert on ETH, which the stream does not carry, moved past its band in the REST snapshot
+# while BTC ticks keep arriving on the stream
+async def partial_stream_cycle(check_alerts):
+    await redis_client.flushdb()
+    await add_alerts(1, {"eth": 100.0})
+    utils.update_price_snapshot({"ETHUSDT": 110.0, "BTCUSDT": 50000.0})
+    utils._last_stream_tick = 0.0
+
+    utils.update_price_snapshot({"BTCUSDT": 50001.0}, complete=False)
+    await check_alerts(SimpleNamespace(bot=None))
+
+
+def test_partial_stream_is_not_live(notifier):
+    utils.update_price_snapshot({"BTCUSDT": 50000.0}, complete=False)
+    assert not utils.is_stream_live()
+
+    utils.update_price_snapshot({"BTCUSDT": 50000.0, "ETHUSDT": 100.0})
+    assert utils.is_stream_live()
+
+
+def test_fixed_cycle_fires_non_streamed_coin(notifier):
+    asyncio.run(partial_stream_cycle(bn.check_alerts))
+    assert len(notifier.sent.get(1, [])) == 1
+    assert "ETH" in notifier.sent[1][0]
+
+
+def test_adaptive_cycle_fires_non_streamed_coin(notifier, monkeypatch):
+    monkeypatch.setattr(scheduler, "_scheduler", scheduler.AlertScheduler())
+    # The snapshot was just filled, so the scheduler must not refetch it
+    monkeypatch.setattr(utils, "_price_snapshot_time", time.monotonic())
+    asyncio.run(partial_stream_cycle(scheduler.check_alerts_adaptive))
+    assert len(notifier.sent.get(1, [])) == 1
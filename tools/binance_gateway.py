@@ -0,0 +1,124 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import time
+from urllib.parse import urlsplit
+
+from tools.init import BINANCE_API_URL, BINANCE_MIRRORS, BINANCE_WEIGHT_LIMIT, BINANCE_BACKGROUND_SHARE, \
+    BINANCE_BACKGROUND_MAX_WAIT
+from tools.metrics import BINANCE_WEIGHT_USED, BINANCE_WEIGHT_REJECTED
+
+# Request-weight budget for the Binance REST API, which bans the IP (418) after repeated 429s.
+# Every Binance request reserves its weight here first; the X-MBX-USED-WEIGHT-1m header of each
+# response corrects the estimate with what all processes on this IP actually used.
+#
+# Interactive commands may use the whole budget. Background work (alert cycles, backfills,
+# registry refreshes) stops at a share of it and waits for the next minute window when that is
+# close, or fails fast so the caller serves its cached data. After a 429/418 every request
+# fails fast until Retry-After has passed.
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+# (weight with a symbol parameter, weight without) per endpoint
+ENDPOINT_WEIGHTS = {
+    "/api/v3/ticker/price": (2, 4),
+    "/api/v3/ticker/24hr": (2, 80),
+    "/api/v3/klines": (2, 2),
+    "/api/v3/exchangeInfo": (20, 20),
+    "/api/v3/avgPrice": (2, 2),
+}
+DEFAULT_WEIGHT = 2
+WINDOW_SECONDS = 60
+# The mirrors count against the same per-IP limit as the main host
+BINANCE_HOSTS = {urlsplit(url).netloc for url in [BINANCE_API_URL, *BINANCE_MIRRORS]}
+
+_priority = contextvars.ContextVar("binance_priority", default=INTERACTIVE)
+
+
+class WeightLimitExceeded(Exception):
+    pass
+
+
+def is_binance(url: str) -> bool:
+    return urlsplit(url).netloc in BINANCE_HOSTS
+
+
+def request_weight(url: str, params: dict = None) -> int:
+    single, bulk = ENDPOINT_WEIGHTS.get(urlsplit(url).path, (DEFAULT_WEIGHT, DEFAULT_WEIGHT))
+    return single if params and "symbol" in params else bulk
+
+
+def set_priority(priority: str):
+    _priority.set(priority)
+
+
+def get_priority() -> str:
+    return _priority.get()
+
+
+# Run a job or loop as background work; tasks it starts inherit the priority
+def background(job):
+    @functools.wraps(job)
+    async def wrapper(*args, **kwargs):
+        token = _priority.set(BACKGROUND)
+        try:
+            return await job(*args, **kwargs)
+        finally:
+            _priority.reset(token)
+
+    return wrapper
+
+
+class WeightBudget:
+    def __init__(self, limit: int = BINANCE_WEIGHT_LIMIT, background_share: float = BINANCE_BACKGROUND_SHARE):
+        self.limit = limit
+        self.background_limit = int(limit * background_share)
+        self.window = 0
+        self.used = 0
+        self.paused_until = 0.0
+
+    def _roll(self, now: float):
+        window = int(now // WINDOW_SECONDS)
+        if window != self.window:
+            self.window = window
+            self.used = 0
+
+    async def acquire(self, cost: int, priority: str = None):
+        priority = priority or get_priority()
+        while True:
+            now = time.time()
+            if now < self.paused_until:
+                BINANCE_WEIGHT_REJECTED.labels(priority).inc()
+                raise WeightLimitExceeded(f"Binance requests paused for {self.paused_until - now:.0f}s")
+
+            self._roll(now)
+            allowed = self.limit if priority == INTERACTIVE else self.background_limit
+            if self.used + cost <= allowed:
+                self.used += cost
+                BINANCE_WEIGHT_USED.set(self.used)
+                return
+
+            # Background work queues for the next window when it is close enough
+            wait = (self.window + 1) * WINDOW_SECONDS - now
+            if priority == INTERACTIVE or wait > BINANCE_BACKGROUND_MAX_WAIT:
+                BINANCE_WEIGHT_REJECTED.labels(priority).inc()
+                raise WeightLimitExceeded(f"Binance weight budget spent ({self.used}/{allowed})")
+            await asyncio.sleep(wait)
+
+    def observe(self, status_code: int, headers):
+        now = time.time()
+        used = headers.get("X-MBX-USED-WEIGHT-1m")
+        if used is not None:
+            self._roll(now)
+            self.used = max(self.used, int(used))
+            BINANCE_WEIGHT_USED.set(self.used)
+
+        if status_code in (418, 429):
+            retry_after = int(headers.get("Retry-After", WINDOW_SECONDS))
+            self.paused_until = max(self.paused_until, now + retry_after)
+            logging.warning(f"Binance answered {status_code}, pausing requests for {retry_after}s")
+
+
+budget = WeightBudget()
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+from cachetools import LRUCache
+
+from tools.init import LOCAL_CACHE_SIZE, CACHE_LOCK_TIMEOUT, redis_client
+from tools.metrics import record_cache
+from tools.singleflight import SingleFlight
+
+# Two-tier cache: a per-process LRU in front of Redis, so every replica reuses what one of them
+# fetched. An entry is fresh for `ttl` seconds, then served stale for up to `stale_ttl` more
+# while a single caller across all processes refreshes it in the background. On a miss one
+# process holds a Redis lock and loads; the others wait for its result.
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_release = redis_client.register_script(RELEASE_SCRIPT)
+
+
+class SharedCache:
+    def __init__(self, name: str, ttl: int, stale_ttl: int, maxsize: int = LOCAL_CACHE_SIZE):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        # key -> (value, fresh_until, stale_until)
+        self.local = LRUCache(maxsize=maxsize)
+        self.flight = SingleFlight()
+        self.refreshing = {}
+
+    def redis_key(self, key: str) -> str:
+        return f"cache:{self.name}:{key}"
+
+    def lock_key(self, key: str) -> str:
+        return f"cache:lock:{self.name}:{key}"
+
+    # Return the cached value for key, calling `await loader(*args)` when there is none. Loaders
+    # return None (or raise) when upstream fails; nothing is cached then.
+    async def get(self, key: str, loader, *args):
+        now = time.time()
+        entry = self.local.get(key)
+        if entry is None or entry[1] <= now:
+            # Another replica may have refreshed it already
+            entry = await self._read(key) or entry
+
+        if entry is not None and entry[2] > now:
+            record_cache(self.name, True)
+            if entry[1] <= now:
+                self._refresh_later(key, loader, *args)
+            return entry[0]
+
+        record_cache(self.name, False)
+        return await self.flight.do(key, self._load, key, loader, *args)
+
+    async def invalidate(self, key: str):
+        self.local.pop(key, None)
+        await redis_client.delete(self.redis_key(key))
+
+    async def _read(self, key: str):
+        data = await redis_client.get(self.redis_key(key))
+        if data is None:
+            return None
+
+        entry = tuple(json.loads(data))
+        self.local[key] = entry
+        return entry
+
+    async def _write(self, key: str, value):
+        now = time.time()
+        entry = (value, now + self.ttl, now + self.ttl + self.stale_ttl)
+        self.local[key] = entry
+        await redis_client.set(self.redis_key(key), json.dumps(entry), exat=int(entry[2]) + 1)
+
+    async def _load(self, key: str, loader, *args, wait: bool = True):
+        token = uuid.uuid4().hex
+        locked = await redis_client.set(self.lock_key(key), token, nx=True, ex=CACHE_LOCK_TIMEOUT)
+        if not locked:
+            if not wait:
+                return None
+
+            # Another process is loading this key; poll for its result instead of calling upstream too
+            deadline = time.time() + CACHE_LOCK_TIMEOUT
+            while time.time() < deadline:
+                await asyncio.sleep(0.1)
+                entry = await self._read(key)
+                if entry is not None and entry[1] > time.time():
+                    return entry[0]
+            logging.warning(f"Gave up waiting for {self.lock_key(key)}, loading it here")
+
+        try:
+            value = await loader(*args)
+            if value is not None:
+                await self._write(key, value)
+            return value
+        finally:
+            if locked:
+                await _release(keys=[self.lock_key(key)], args=[token])
+
+    def _refresh_later(self, key: str, loader, *args):
+        if key in self.refreshing:
+            return
+
+        async def refresh():
+            try:
+                # A separate flight, so a miss never joins a refresh that gives up when another
+                # process holds the lock and comes back empty
+                await self.flight.do(("refresh", key), self._load, key, loader, *args, wait=False)
+            except Exception as e:
+                logging.error(f"Failed to refresh {self.redis_key(key)}: {e}")
+            finally:
+                self.refreshing.pop(key, None)
+
+        self.refreshing[key] = asyncio.ensure_future(refresh())
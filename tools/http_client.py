@@ -0,0 +1,64 @@
+import httpx
+
+from tools.binance_gateway import WeightLimitExceeded, budget, is_binance, request_weight
+from tools.init import HTTP_TIMEOUT, HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_RECORD_PATH
+from tools.metrics import UPSTREAM_REQUESTS, instrument_upstream, upstream_endpoint
+from tools.recorder import Recorder
+
+# One pooled client per process so upstream TLS connections are kept alive and reused
+_client = None
+# Successful responses are also written here when HTTP_RECORD_PATH is set, for bench.simulate
+_recorder = Recorder(HTTP_RECORD_PATH) if HTTP_RECORD_PATH else None
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_TIMEOUT),
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+        )
+    return _client
+
+
+async def get_json(url: str, params: dict = None, timeout: float = None):
+    # Binance requests go through the weight budget, which raises WeightLimitExceeded when spent.
+    # Those requests are never sent, so they are counted apart from upstream errors.
+    binance = is_binance(url)
+    if binance:
+        try:
+            await budget.acquire(request_weight(url, params))
+        except WeightLimitExceeded:
+            UPSTREAM_REQUESTS.labels(upstream_endpoint(url), "rejected").inc()
+            raise
+
+    return await _request(url, params, timeout, binance)
+
+
+@instrument_upstream
+async def _request(url: str, params: dict, timeout: float, binance: bool):
+    kwargs = {}
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+
+    response = await get_client().get(url, params=params, **kwargs)
+    if binance:
+        budget.observe(response.status_code, response.headers)
+    response.raise_for_status()
+    data = response.json()
+    if _recorder is not None:
+        _recorder.record(url, params, data)
+    return data
+
+
+async def close_client():
+    global _client, _recorder
+
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    if _recorder is not None:
+        _recorder.close()
+        _recorder = None
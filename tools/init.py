@@ -1,12 +1,132 @@
 import os
-from redis import Redis
+from redis.asyncio import Redis, BlockingConnectionPool
 
 # Initialize environment variables
 TELEGRAM_API_KEY = os.environ.get("TELEGRAM_API_KEY")
+# Bot API endpoint; point it at a local stand-in to run the bot offline
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+
+# Receive updates on an embedded webhook server instead of long polling when WEBHOOK_URL (the public
+# base URL Telegram should call) is set. Updates are served on WEBHOOK_PATH and must carry WEBHOOK_SECRET
+# in the X-Telegram-Bot-Api-Secret-Token header.
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", 8443))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram").strip("/")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+# Simultaneous HTTPS connections Telegram may open to the webhook
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", 40))
+# Updates handled concurrently, in both polling and webhook mode
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", 16))
+# Seconds to wait for queued notifications on shutdown; the rest stay in the Redis backlog
+SHUTDOWN_TIMEOUT = float(os.environ.get("SHUTDOWN_TIMEOUT", 10))
 
 PERCENTAGE_CHANGE = int(os.environ.get("PERCENTAGE_CHANGE", 3))
+# Seconds between alert evaluation cycles
+ALERT_INTERVAL = int(os.environ.get("ALERT_INTERVAL", 180))
+# "adaptive" checks each coin as often as its volatility and distance to the nearest alert
+# warrant, between ALERT_MIN_INTERVAL and ALERT_MAX_LATENCY seconds; "fixed" checks every
+# coin every ALERT_INTERVAL seconds
+ALERT_SCHEDULER = os.environ.get("ALERT_SCHEDULER", "adaptive").lower()
+ALERT_MIN_INTERVAL = int(os.environ.get("ALERT_MIN_INTERVAL", 5))
+ALERT_MAX_LATENCY = int(os.environ.get("ALERT_MAX_LATENCY", ALERT_INTERVAL))
+# "numpy" evaluates alerts against an in-memory columnar copy kept in sync through the alerts:changes
+# stream; "redis" range-queries the Redis trigger index on every cycle
+ALERT_ENGINE = os.environ.get("ALERT_ENGINE", "numpy").lower()
+# Entries kept in the alerts:changes stream; an engine that falls further behind reloads in full
+ALERT_CHANGES_MAXLEN = int(os.environ.get("ALERT_CHANGES_MAXLEN", 100000))
+# Seconds a bulk ticker snapshot is reused before being refetched
+PRICE_SNAPSHOT_TTL = int(os.environ.get("PRICE_SNAPSHOT_TTL", 10))
+# The first alert cycle starts at a random point within this many seconds, so replicas restarted
+# together by a redeploy do not all hit upstream at once
+ALERT_START_JITTER = float(os.environ.get("ALERT_START_JITTER", 30))
+# Seconds from process start to serving updates before startup is logged as too slow
+STARTUP_BUDGET = float(os.environ.get("STARTUP_BUDGET", 5))
+
+# Upstream HTTP settings
+BINANCE_API_URL = os.environ.get("BINANCE_API_URL", "https://api.binance.com")
+COINGECKO_API_URL = os.environ.get("COINGECKO_API_URL", "https://api.coingecko.com/api/v3")
+# Bulk prices are also fetched from these hosts when the primary is slow or failing; empty disables them
+BINANCE_MIRRORS = [url.strip().rstrip("/") for url in os.environ.get(
+    "BINANCE_MIRRORS", "https://api1.binance.com,https://api2.binance.com,https://api3.binance.com").split(",")
+    if url.strip()]
+# Look up coins missing from the Binance snapshot on CoinGecko simple/price
+COINGECKO_FALLBACK = os.environ.get("COINGECKO_FALLBACK", "true").lower() in ("1", "true", "yes")
+# Seconds to wait for a price source before hedging with the next one, until its p95 latency is known
+SOURCE_HEDGE_DELAY = float(os.environ.get("SOURCE_HEDGE_DELAY", 0.5))
+# Consecutive failures that open a source's circuit, and seconds before it is tried again
+SOURCE_FAILURE_THRESHOLD = int(os.environ.get("SOURCE_FAILURE_THRESHOLD", 3))
+SOURCE_COOLDOWN = float(os.environ.get("SOURCE_COOLDOWN", 30))
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", 10))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", 20))
+# Write every successful upstream response to this gzipped JSON lines file for replay with bench.simulate
+HTTP_RECORD_PATH = os.environ.get("HTTP_RECORD_PATH", "")
+# Binance request weight this IP may use per minute (Binance allows 6000); background work stops at
+# BINANCE_BACKGROUND_SHARE of it and waits at most BINANCE_BACKGROUND_MAX_WAIT seconds for the next minute
+BINANCE_WEIGHT_LIMIT = int(os.environ.get("BINANCE_WEIGHT_LIMIT", 5000))
+BINANCE_BACKGROUND_SHARE = float(os.environ.get("BINANCE_BACKGROUND_SHARE", 0.7))
+BINANCE_BACKGROUND_MAX_WAIT = float(os.environ.get("BINANCE_BACKGROUND_MAX_WAIT", 10))
+
+# Seconds a rendered /p table is reused for identical coin lists
+RENDER_CACHE_TTL = int(os.environ.get("RENDER_CACHE_TTL", 5))
+# Minimum seconds between two Refresh edits of the same message
+REFRESH_THROTTLE = int(os.environ.get("REFRESH_THROTTLE", 3))
+
+# Chart rendering runs in a process pool of this size
+CHART_WORKERS = int(os.environ.get("CHART_WORKERS", 2))
+CHART_CANDLES = int(os.environ.get("CHART_CANDLES", 96))
+
+# CoinGecko responses are shared between replicas through Redis: fresh for the TTL, then served stale
+# for CACHE_STALE_TTL more seconds while one process refreshes them
+TRENDING_CACHE_TTL = int(os.environ.get("TRENDING_CACHE_TTL", 300))
+COIN_INFO_CACHE_TTL = int(os.environ.get("COIN_INFO_CACHE_TTL", 120))
+CACHE_STALE_TTL = int(os.environ.get("CACHE_STALE_TTL", 900))
+# Entries kept in each process in front of Redis, per cache
+LOCAL_CACHE_SIZE = int(os.environ.get("LOCAL_CACHE_SIZE", 1024))
+# Seconds one process may hold the lock while loading a missing entry
+CACHE_LOCK_TIMEOUT = int(os.environ.get("CACHE_LOCK_TIMEOUT", 10))
+
+# Seconds between refreshes of the Binance pair and CoinGecko coin registries
+SYMBOLS_REFRESH = int(os.environ.get("SYMBOLS_REFRESH", 6 * 3600))
+
+# Streaming market data (Binance WebSocket miniTicker) instead of REST polling
+STREAM_MODE = os.environ.get("STREAM_MODE", "false").lower() in ("1", "true", "yes")
+BINANCE_WS_URL = os.environ.get("BINANCE_WS_URL", "wss://stream.binance.com:9443")
+# Comma separated coins to subscribe to individually; empty subscribes to !miniTicker@arr
+STREAM_SYMBOLS = [coin.strip().lower() for coin in os.environ.get("STREAM_SYMBOLS", "").split(",") if coin.strip()]
+# Seconds without a tick before falling back to REST polling
+STREAM_STALE_AFTER = int(os.environ.get("STREAM_STALE_AFTER", 10))
+
+# Evaluate alerts in separate worker processes (worker.py) instead of the bot process
+ALERT_WORKERS = os.environ.get("ALERT_WORKERS", "false").lower() in ("1", "true", "yes")
+# Coins are hashed into this many shards, which workers own through Redis leases
+ALERT_SHARDS = int(os.environ.get("ALERT_SHARDS", 64))
+WORKER_HEARTBEAT = int(os.environ.get("WORKER_HEARTBEAT", 10))
+# Seconds after the last heartbeat before a worker's shards are handed to the others
+WORKER_TTL = int(os.environ.get("WORKER_TTL", 30))
+
+# Outbound Telegram notifications. Telegram allows ~30 msg/s per bot, so split the global
+# rate between processes when several workers send alerts.
+NOTIFY_GLOBAL_RATE = float(os.environ.get("NOTIFY_GLOBAL_RATE", 25))
+NOTIFY_CHAT_RATE = float(os.environ.get("NOTIFY_CHAT_RATE", 1))
+NOTIFY_CONCURRENCY = int(os.environ.get("NOTIFY_CONCURRENCY", 8))
+NOTIFY_MAX_RETRIES = int(os.environ.get("NOTIFY_MAX_RETRIES", 5))
+
+# Port of the Prometheus metrics endpoint; 0 disables it
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9108))
+# Ports tried after METRICS_PORT when it is taken, e.g. by other workers on the same host
+METRICS_PORT_RANGE = int(os.environ.get("METRICS_PORT_RANGE", 16))
+
 REDIS_HOST = os.environ.get("REDIS_HOST", "redis")
 REDIS_PORT = int(os.environ.get("REDIS_PORT", 6379))
+REDIS_DB = int(os.environ.get("REDIS_DB", 0))
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 50))
+# Seconds a command waits for a free connection when all REDIS_MAX_CONNECTIONS are busy
+REDIS_POOL_TIMEOUT = float(os.environ.get("REDIS_POOL_TIMEOUT", 10))
+
+# Initialize Redis client; a burst beyond the pool size queues for a connection instead of failing
+redis_pool = BlockingConnectionPool(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, max_connections=REDIS_MAX_CONNECTIONS,
+                                   timeout=REDIS_POOL_TIMEOUT)
+redis_client = Redis(connection_pool=redis_pool)
 
-# Initialize Redis client
-redis_client = Redis(host=REDIS_HOST, port=REDIS_PORT)
@@ -0,0 +1,164 @@
+import functools
+import logging
+import time
+from urllib.parse import urlsplit
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram, start_http_server
+
+from tools.init import METRICS_PORT, METRICS_PORT_RANGE, COINGECKO_API_URL
+
+# Prometheus metrics for the bot and workers. Instrumentation is applied with the
+# decorators and hooks below rather than timing code inside the handlers.
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Handler latency", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Handler exceptions", ["handler"])
+
+UPSTREAM_SECONDS = Histogram("bot_upstream_seconds", "Upstream request latency", ["endpoint"])
+UPSTREAM_REQUESTS = Counter("bot_upstream_requests_total", "Upstream requests", ["endpoint", "status"])
+
+BINANCE_WEIGHT_USED = Gauge("bot_binance_weight_used", "Binance request weight used in the current minute")
+BINANCE_WEIGHT_REJECTED = Counter("bot_binance_weight_rejected_total", "Binance requests refused by the weight budget",
+                                  ["priority"])
+
+PRICE_SOURCE_OPEN = Gauge("bot_price_source_circuit_open", "1 while a price source's circuit breaker is open",
+                          ["source"])
+PRICE_SOURCE_HEDGES = Counter("bot_price_source_hedges_total", "Hedged requests sent to a backup price source",
+                              ["source"])
+
+STARTUP_SECONDS = Gauge("bot_startup_seconds", "Seconds spent in each startup phase", ["phase"])
+
+REDIS_ROUND_TRIPS = Counter("bot_redis_round_trips_total", "Redis round trips", ["kind"])
+
+CYCLE_SECONDS = Histogram("bot_alert_cycle_seconds", "Alert evaluation duration",
+                          buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 180))
+CYCLE_USERS = Gauge("bot_alert_cycle_users", "Users with an alert on a coin priced in the last alert evaluation")
+CYCLE_USERS_NOTIFIED = Gauge("bot_alert_cycle_users_notified", "Users notified in the last alert evaluation")
+ALERTS_EVALUATED = Counter("bot_alerts_evaluated_total", "Alerts found past their trigger band, fired or not")
+ALERTS_FIRED = Counter("bot_alerts_fired_total", "Alerts fired")
+
+CACHE_LOOKUPS = Counter("bot_cache_lookups_total", "Cache lookups", ["cache", "result"])
+
+NOTIFY_QUEUE_DEPTH = Gauge("bot_notify_queue_depth", "Messages waiting to be delivered")
+NOTIFY_SECONDS = Histogram("bot_notify_delivery_seconds", "Time from queuing to delivery of a message",
+                           buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300))
+
+UPSTREAM_ENDPOINTS = {
+    "/api/v3/ticker/price": "ticker",
+    "/api/v3/klines": "klines",
+    "/api/v3/exchangeInfo": "exchange_info",
+}
+
+
+# The bot and any local workers share one host, so each process takes the first free port
+# from METRICS_PORT on; a process that finds none runs without an endpoint
+def start_metrics_server():
+    if not METRICS_PORT:
+        return
+
+    for port in range(METRICS_PORT, METRICS_PORT + METRICS_PORT_RANGE):
+        try:
+            start_http_server(port)
+        except OSError:
+            continue
+        logging.info(f"Serving metrics on port {port}")
+        return
+    logging.error(f"No free metrics port in {METRICS_PORT}-{METRICS_PORT + METRICS_PORT_RANGE - 1}, metrics are "
+                  f"not served")
+
+
+def upstream_endpoint(url: str) -> str:
+    if url.startswith(COINGECKO_API_URL):
+        return "coingecko"
+    return UPSTREAM_ENDPOINTS.get(urlsplit(url).path, "other")
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+
+# Time a Telegram handler or job and count the exceptions it raises
+def instrument_handler(handler):
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.labels(name).inc()
+            raise
+        finally:
+            HANDLER_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+    return wrapper
+
+
+# Time an upstream call whose first argument is the URL, labelled by endpoint and outcome
+def instrument_upstream(request):
+    @functools.wraps(request)
+    async def wrapper(url, *args, **kwargs):
+        endpoint = upstream_endpoint(url)
+        start = time.perf_counter()
+        status = "error"
+        try:
+            result = await request(url, *args, **kwargs)
+            status = "ok"
+            return result
+        except Exception as e:
+            response = getattr(e, "response", None)
+            if response is not None:
+                status = str(response.status_code)
+            raise
+        finally:
+            UPSTREAM_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+            UPSTREAM_REQUESTS.labels(endpoint, status).inc()
+
+    return wrapper
+
+
+# Time an alert evaluation; the wrapped coroutine returns (users, evaluated, fired, notified)
+def instrument_cycle(evaluate):
+    @functools.wraps(evaluate)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        users, evaluated, fired, notified = await evaluate(*args, **kwargs)
+        CYCLE_SECONDS.observe(time.perf_counter() - start)
+        CYCLE_USERS.set(users)
+        ALERTS_EVALUATED.inc(evaluated)
+        ALERTS_FIRED.inc(fired)
+        CYCLE_USERS_NOTIFIED.set(notified)
+        return users, evaluated, fired, notified
+
+    return wrapper
+
+
+# Count the round trips made through a Redis client: one per command, one per pipeline
+def instrument_redis(client):
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    async def counted_command(*args, **kwargs):
+        REDIS_ROUND_TRIPS.labels("command").inc()
+        return await execute_command(*args, **kwargs)
+
+    def counted_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def counted_execute(*execute_args, **execute_kwargs):
+            REDIS_ROUND_TRIPS.labels("pipeline").inc()
+            return await execute(*execute_args, **execute_kwargs)
+
+        pipe.execute = counted_execute
+        return pipe
+
+    client.execute_command = counted_command
+    client.pipeline = counted_pipeline
+    return client
+
+
+# Redis round trips counted by instrument_redis so far in this process
+def redis_round_trips() -> float:
+    return sum(REGISTRY.get_sample_value("bot_redis_round_trips_total", {"kind": kind}) or 0
+               for kind in ("command", "pipeline"))
@@ -0,0 +1,275 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import deque
+
+from cachetools import TTLCache
+from telegram.error import RetryAfter, Forbidden, BadRequest
+
+from tools.metrics import NOTIFY_QUEUE_DEPTH, NOTIFY_SECONDS
+from tools.init import (redis_client, NOTIFY_GLOBAL_RATE, NOTIFY_CHAT_RATE, NOTIFY_CONCURRENCY, NOTIFY_MAX_RETRIES,
+                        WORKER_HEARTBEAT, WORKER_TTL)
+
+# Outbound message pipeline: messages are written to a Redis backlog, queued in memory and
+# sent by a few consumers under a global and a per-chat token bucket. Entries leave the
+# backlog only once Telegram accepted them, so undelivered alerts survive a restart.
+#
+# Every process has its own backlog and heartbeats in the notify:owners zset. Once an owner's
+# heartbeat is older than WORKER_TTL, the first live notifier to see it moves that backlog into
+# its own in one script, so a recreated container loses nothing. An owner only sends while its
+# last heartbeat is under half that old; past it, it renews first and skips what was taken.
+OWNERS_KEY = "notify:owners"
+BACKLOG_PREFIX = "notify:backlog:"
+# Telegram rejects longer messages outright
+MESSAGE_LIMIT = 4096
+
+CLAIM_SCRIPT = """
+local seen = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if seen and tonumber(seen) >= tonumber(ARGV[2]) then
+    return {}
+end
+local entries = redis.call('HGETALL', KEYS[2])
+for i = 1, #entries, 2 do
+    redis.call('HSET', KEYS[3], entries[i], entries[i + 1])
+end
+redis.call('DEL', KEYS[2])
+redis.call('ZREM', KEYS[1], ARGV[1])
+return entries
+"""
+
+_claim = redis_client.register_script(CLAIM_SCRIPT)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# Join texts with blank lines into chunks of at most MESSAGE_LIMIT characters. Chunks break
+# between texts where possible, a text too long on its own breaks at line ends, and a single
+# line too long is cut.
+def split_message(texts: list, limit: int = MESSAGE_LIMIT) -> list:
+    parts = []
+    for text in texts:
+        if len(text) <= limit:
+            parts.append((text, "\n\n"))
+            continue
+        for number, line in enumerate(text.split("\n")):
+            parts.extend((line[i:i + limit], "\n" if number or i else "\n\n")
+                         for i in range(0, max(len(line), 1), limit))
+
+    chunks = []
+    for part, separator in parts:
+        if chunks and len(chunks[-1]) + len(separator) + len(part) <= limit:
+            chunks[-1] += separator + part
+        else:
+            chunks.append(part)
+    return chunks
+
+
+class Notifier:
+    def __init__(self, bot, owner_id: str = None):
+        self.bot = bot
+        self.owner_id = owner_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.backlog_key = BACKLOG_PREFIX + self.owner_id
+        self.queue = asyncio.Queue()
+        self.queued_ids = set()
+        self.global_bucket = TokenBucket(NOTIFY_GLOBAL_RATE)
+        self.chat_buckets = TTLCache(maxsize=100000, ttl=60)
+        self.paused_until = 0.0
+        # Monotonic time until which no peer can have claimed this backlog
+        self.lease_until = 0.0
+        # Wall time at which this backlog was found claimed by a peer, if ever
+        self.claimed_at = 0.0
+        self.consumers = []
+        self.delivered = 0
+        self.failed = 0
+        self.retried = 0
+        self.latencies = deque(maxlen=1000)
+        NOTIFY_QUEUE_DEPTH.set_function(self.queue.qsize)
+
+    async def start(self):
+        # Register before claiming, so no peer takes this backlog for an orphan
+        await self._renew()
+        await self._claim_orphans()
+
+        self.consumers = [asyncio.ensure_future(self._consume()) for _ in range(NOTIFY_CONCURRENCY)]
+        self.consumers.append(asyncio.ensure_future(self._heartbeat()))
+        self.consumers.append(asyncio.ensure_future(self._report()))
+
+    async def stop(self):
+        for consumer in self.consumers:
+            consumer.cancel()
+        await asyncio.gather(*self.consumers, return_exceptions=True)
+        self.consumers = []
+        # Whatever is still undelivered goes to the next live notifier right away
+        await redis_client.zadd(OWNERS_KEY, {self.owner_id: 0})
+        self.lease_until = 0.0
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(WORKER_HEARTBEAT)
+            try:
+                await self._renew()
+                await self._claim_orphans()
+            except Exception as e:
+                logging.error(f"Error in notifier heartbeat: {e}")
+
+    async def _renew(self):
+        started = time.monotonic()
+        # ZADD only adds a new member when a peer claimed this backlog and removed the owner
+        if await redis_client.zadd(OWNERS_KEY, {self.owner_id: time.time()}) and self.lease_until:
+            logging.warning(f"Notifier {self.owner_id} stalled and its backlog was claimed by a peer")
+            self.claimed_at = time.time()
+        self.lease_until = started + WORKER_TTL / 2
+
+    # Move the backlogs of owners that stopped heartbeating into this one and queue them
+    async def _claim_orphans(self):
+        cutoff = time.time() - WORKER_TTL
+        restored = 0
+        for owner_id in await redis_client.zrangebyscore(OWNERS_KEY, "-inf", cutoff):
+            owner_id = owner_id.decode("utf-8")
+            if owner_id == self.owner_id:
+                continue
+            entries = await _claim(keys=[OWNERS_KEY, BACKLOG_PREFIX + owner_id, self.backlog_key],
+                                   args=[owner_id, cutoff])
+            for message_id, data in zip(entries[::2], entries[1::2]):
+                message_id = message_id.decode("utf-8")
+                if message_id not in self.queued_ids:
+                    self._put(message_id, json.loads(data))
+                    restored += 1
+        if restored:
+            logging.info(f"Restored {restored} undelivered messages")
+
+    # Wait until everything queued so far has been delivered or given up on
+    async def drain(self, timeout: float = None):
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Stopped waiting with {self.queue.qsize()} messages still queued")
+
+    # Queue the texts produced for a chat in this cycle, coalesced into as few messages as fit
+    async def send(self, chat_id: int, texts: list, parse_mode: str = "HTML"):
+        created = time.time()
+        messages = {uuid.uuid4().hex: {"chat_id": chat_id, "text": text, "parse_mode": parse_mode,
+                                       "created": created, "attempts": 0}
+                    for text in split_message(texts)}
+        if not messages:
+            return
+        await redis_client.hset(self.backlog_key, mapping={message_id: json.dumps(message)
+                                                           for message_id, message in messages.items()})
+        for message_id, message in messages.items():
+            self._put(message_id, message)
+
+    def _put(self, message_id: str, message: dict):
+        self.queued_ids.add(message_id)
+        self.queue.put_nowait((message_id, message))
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(NOTIFY_CHAT_RATE)
+        return bucket
+
+    async def _consume(self):
+        while True:
+            message_id, message = await self.queue.get()
+            try:
+                await self._deliver(message_id, message)
+            except Exception as e:
+                logging.error(f"Error delivering message to {message['chat_id']}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, message_id: str, message: dict):
+        while True:
+            # A flood-control response from Telegram pauses every consumer, not just this one
+            delay = self.paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            await self._chat_bucket(message["chat_id"]).acquire()
+            await self.global_bucket.acquire()
+
+            # A stalled process renews before sending and skips what a peer claimed meanwhile
+            if time.monotonic() > self.lease_until:
+                await self._renew()
+            if message["created"] < self.claimed_at and not await redis_client.hexists(self.backlog_key, message_id):
+                self.queued_ids.discard(message_id)
+                return
+
+            try:
+                await self.bot.send_message(chat_id=message["chat_id"], text=message["text"],
+                                            parse_mode=message["parse_mode"])
+            except RetryAfter as e:
+                retry_after = getattr(e.retry_after, "total_seconds", lambda: e.retry_after)()
+                self.paused_until = time.monotonic() + retry_after
+                self.retried += 1
+                continue
+            except (Forbidden, BadRequest) as e:
+                # The chat blocked the bot or the message is invalid; retrying will not help
+                logging.error(f"Dropping message to {message['chat_id']}: {e}")
+                self.failed += 1
+            except Exception as e:
+                message["attempts"] += 1
+                if message["attempts"] < NOTIFY_MAX_RETRIES:
+                    self.retried += 1
+                    await asyncio.sleep(2 ** message["attempts"])
+                    continue
+                logging.error(f"Giving up on message to {message['chat_id']}: {e}")
+                self.failed += 1
+            else:
+                self.delivered += 1
+                self.latencies.append(time.time() - message["created"])
+                NOTIFY_SECONDS.observe(self.latencies[-1])
+
+            self.queued_ids.discard(message_id)
+            await redis_client.hdel(self.backlog_key, message_id)
+            return
+
+    async def _report(self, interval: float = 60):
+        while True:
+            await asyncio.sleep(interval)
+            stats = self.stats()
+            if stats["queue_depth"] or self.latencies:
+                logging.info("Notifications: " + ", ".join(f"{key}={value:.2f}" if isinstance(value, float)
+                                                           else f"{key}={value}" for key, value in stats.items()))
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        return {
+            "queue_depth": self.queue.qsize(),
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "failed": self.failed,
+            "latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+            "latency_p99": latencies[int(len(latencies) * 0.99)] if latencies else 0.0,
+        }
+
+
+_notifier = None
+
+
+def get_notifier(bot) -> Notifier:
+    global _notifier
+
+    if _notifier is None:
+        _notifier = Notifier(bot)
+    return _notifier
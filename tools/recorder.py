@@ -0,0 +1,55 @@
+import gzip
+import json
+import time
+from urllib.parse import urlsplit
+
+# Records upstream responses as gzipped JSON lines for bench.simulate to replay. A bulk ticker
+# response is stored as just the prices that changed since the previous one, which keeps a day
+# of 10s snapshots of every Binance symbol to a few tens of MB.
+#
+#   HTTP_RECORD_PATH=market.jsonl.gz python alert.py
+
+TICKER_PATH = "/api/v3/ticker/price"
+# Seconds between flushes; a crash loses at most this much of the recording
+FLUSH_INTERVAL = 60
+
+
+class Recorder:
+    def __init__(self, path: str):
+        self.file = gzip.open(path, "at", encoding="utf-8")
+        self.prices = {}
+        self.flushed = time.monotonic()
+
+    def record(self, url: str, params: dict, body):
+        entry = {"time": time.time(), "url": url, "params": params or {}}
+        if urlsplit(url).path == TICKER_PATH and isinstance(body, list):
+            prices = {ticker["symbol"]: ticker["price"] for ticker in body}
+            entry["ticker"] = {symbol: price for symbol, price in prices.items() if self.prices.get(symbol) != price}
+            self.prices = prices
+        else:
+            entry["body"] = body
+        self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+        if time.monotonic() - self.flushed >= FLUSH_INTERVAL:
+            self.file.flush()
+            self.flushed = time.monotonic()
+
+    def close(self):
+        self.file.close()
+
+
+# Yield the recorded entries in order. Ticker entries get "prices", the full {symbol: price}
+# table at that time; it is the same dict updated in place, so copy what you keep.
+def read_records(path: str):
+    prices = {}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                entry = json.loads(line)
+                if "ticker" in entry:
+                    prices.update(entry.pop("ticker"))
+                    entry["prices"] = prices
+                yield entry
+        except (EOFError, json.JSONDecodeError):
+            # The recording process was killed mid-write; everything before that is usable
+            pass
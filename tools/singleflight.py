@@ -0,0 +1,34 @@
+import asyncio
+
+from tools.binance_gateway import INTERACTIVE, WeightLimitExceeded, get_priority
+
+# Coalesces concurrent identical calls: while a call for a key is in flight, later callers
+# await the same result instead of starting their own.
+
+
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}
+
+    async def do(self, key, fn, *args, **kwargs):
+        while True:
+            call = self.calls.get(key)
+            if call is None:
+                # The call runs with the Binance priority of the caller that starts it
+                call = self.calls[key] = (asyncio.ensure_future(fn(*args, **kwargs)), get_priority())
+                call[0].add_done_callback(lambda _, call=call: self._done(key, call))
+            future, priority = call
+
+            try:
+                # A cancelled caller must not cancel the call the others are waiting on
+                return await asyncio.shield(future)
+            except WeightLimitExceeded:
+                # Background work refused by the weight budget must not fail the interactive
+                # callers that joined it; they retry under their own priority
+                if priority == INTERACTIVE or get_priority() != INTERACTIVE:
+                    raise
+                self._done(key, call)
+
+    def _done(self, key, call):
+        if self.calls.get(key) is call:
+            del self.calls[key]
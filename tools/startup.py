@@ -0,0 +1,59 @@
+import importlib
+import logging
+import time
+
+# Startup timing and lazy command modules. alert.py and worker.py import this module before
+# anything else, so PROCESS_START is as close to the start of the process as Python allows and
+# the "imports" phase covers every module loaded at startup. This module only imports the
+# standard library at the top for the same reason.
+
+PROCESS_START = time.monotonic()
+
+
+class StartupTimer:
+    def __init__(self, name: str):
+        self.name = name
+        self.last = PROCESS_START
+        # [(phase, seconds), ...] in the order they finished
+        self.phases = []
+
+    # Close the phase running since the previous mark
+    def mark(self, phase: str):
+        now = time.monotonic()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    # Time one of several steps awaited together; the enclosing mark covers their wall time
+    async def timed(self, phase: str, awaitable):
+        start = time.monotonic()
+        try:
+            return await awaitable
+        finally:
+            self.phases.append((phase, time.monotonic() - start))
+
+    def done(self):
+        from tools.init import STARTUP_BUDGET
+        from tools.metrics import STARTUP_SECONDS
+
+        total = time.monotonic() - PROCESS_START
+        for phase, seconds in self.phases:
+            STARTUP_SECONDS.labels(phase).set(seconds)
+        STARTUP_SECONDS.labels("total").set(total)
+
+        phases = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.phases)
+        if total > STARTUP_BUDGET:
+            logging.warning(f"{self.name} started in {total:.2f}s, over the {STARTUP_BUDGET:g}s budget ({phases})")
+        else:
+            logging.info(f"{self.name} started in {total:.2f}s ({phases})")
+        return total
+
+
+# Handler that imports its module on first use, so commands with heavy dependencies cost
+# nothing at startup
+def lazy_handler(module: str, name: str):
+    async def handler(*args, **kwargs):
+        return await getattr(importlib.import_module(module), name)(*args, **kwargs)
+
+    # instrument_handler labels metrics with the handler name
+    handler.__name__ = name
+    return handler
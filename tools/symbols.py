@@ -0,0 +1,167 @@
+import difflib
+import json
+import logging
+import time
+
+from tools.http_client import get_json
+from tools.init import redis_client, BINANCE_API_URL, COINGECKO_API_URL, SYMBOLS_REFRESH
+
+# Registry of tradable Binance pairs and CoinGecko coin ids, held in dicts so user input is
+# validated and corrected locally before any upstream request is made. The registry is
+# shared through Redis and refreshed every SYMBOLS_REFRESH seconds.
+BINANCE_KEY = "symbols:binance"
+COINGECKO_KEY = "symbols:coingecko"
+NAMES_KEY = "symbols:names"
+UPDATED_KEY = "symbols:updated"
+LOCK_KEY = "symbols:refresh:lock"
+
+# Market-cap ranked pages used to pick the right coin when several share a symbol
+MARKET_PAGES = 2
+
+_binance_pairs = {}
+_coingecko_ids = {}
+_coin_names = {}
+_updated = 0.0
+
+
+def is_loaded() -> bool:
+    return bool(_binance_pairs)
+
+
+def binance_pairs(coin_id: str):
+    return _binance_pairs.get(coin_id.lower(), set())
+
+
+# {base asset: {quote assets}} for every trading pair
+def all_binance_pairs() -> dict:
+    return _binance_pairs
+
+
+# Changes whenever a new registry is loaded
+def registry_updated() -> float:
+    return _updated
+
+
+# Unknown until the registry is loaded, so lookups are never blocked by a cold start
+def is_listed(coin_id: str, quote: str = "USDT") -> bool:
+    if not is_loaded():
+        return True
+    return quote in _binance_pairs.get(coin_id.lower(), ())
+
+
+def coingecko_id(symbol: str):
+    return _coingecko_ids.get(symbol.lower())
+
+
+# Map user input to a listed coin: "btc", "BTCUSDT" and "bitcoin" all resolve to "btc".
+# Returns (coin_id, suggestion); coin_id is None when nothing matched.
+def resolve_coin(text: str, quote: str = "USDT"):
+    coin_id = text.lower().strip()
+    if is_listed(coin_id, quote):
+        return coin_id, None
+
+    suffix = quote.lower()
+    if coin_id.endswith(suffix) and is_listed(coin_id[:-len(suffix)], quote):
+        return coin_id[:-len(suffix)], None
+
+    symbol = _coin_names.get(coin_id)
+    if symbol and is_listed(symbol, quote):
+        return symbol, None
+
+    # Only a miss pays for the fuzzy search
+    matches = difflib.get_close_matches(coin_id, list(_binance_pairs), n=1, cutoff=0.75)
+    return None, matches[0] if matches else None
+
+
+async def fetch_binance_pairs():
+    exchange_info = await get_json(f"{BINANCE_API_URL}/api/v3/exchangeInfo", params={"permissions": "SPOT"})
+    pairs = {}
+    for symbol in exchange_info["symbols"]:
+        if symbol["status"] == "TRADING":
+            pairs.setdefault(symbol["baseAsset"].lower(), set()).add(symbol["quoteAsset"])
+    return pairs
+
+
+async def fetch_coingecko_ids():
+    coins = await get_json(f"{COINGECKO_API_URL}/coins/list")
+
+    ranks = {}
+    for page in range(1, MARKET_PAGES + 1):
+        markets = await get_json(f"{COINGECKO_API_URL}/coins/markets",
+                                 params={"vs_currency": "usd", "order": "market_cap_desc", "per_page": 250,
+                                         "page": page})
+        for market in markets:
+            ranks[market["id"]] = market.get("market_cap_rank") or len(ranks) + 1
+
+    ids = {}
+    names = {}
+    for coin in coins:
+        symbol = coin["symbol"].lower()
+        current = ids.get(symbol)
+        if current is None or ranks.get(coin["id"], float("inf")) < ranks.get(current, float("inf")):
+            ids[symbol] = coin["id"]
+
+    # Names and ids only autocorrect to the coin that actually owns the symbol
+    for coin in coins:
+        symbol = coin["symbol"].lower()
+        if ids[symbol] == coin["id"]:
+            names[coin["name"].lower()] = symbol
+            names[coin["id"]] = symbol
+    return ids, names
+
+
+async def refresh_symbols():
+    global _binance_pairs, _coingecko_ids, _coin_names, _updated
+
+    pairs = await fetch_binance_pairs()
+    try:
+        ids, names = await fetch_coingecko_ids()
+    except Exception as e:
+        # CoinGecko's free tier is easily rate limited; keep the previous coin ids
+        logging.error(f"Error fetching CoinGecko coin list: {e}")
+        ids, names = _coingecko_ids, _coin_names
+
+    now = time.time()
+    pipe = redis_client.pipeline()
+    pipe.delete(BINANCE_KEY, COINGECKO_KEY, NAMES_KEY)
+    pipe.hset(BINANCE_KEY, mapping={coin: json.dumps(sorted(quotes)) for coin, quotes in pairs.items()})
+    if ids:
+        pipe.hset(COINGECKO_KEY, mapping=ids)
+        pipe.hset(NAMES_KEY, mapping=names)
+    pipe.set(UPDATED_KEY, now)
+    await pipe.execute()
+
+    _binance_pairs, _coingecko_ids, _coin_names, _updated = pairs, ids, names, now
+    logging.info(f"Symbol registry refreshed: {len(pairs)} Binance assets, {len(ids)} CoinGecko symbols")
+
+
+async def load_symbols():
+    global _binance_pairs, _coingecko_ids, _coin_names, _updated
+
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.get(UPDATED_KEY)
+    pipe.hgetall(BINANCE_KEY)
+    pipe.hgetall(COINGECKO_KEY)
+    pipe.hgetall(NAMES_KEY)
+    updated, pairs, ids, names = await pipe.execute()
+
+    _binance_pairs = {coin.decode("utf-8"): set(json.loads(quotes)) for coin, quotes in pairs.items()}
+    _coingecko_ids = {symbol.decode("utf-8"): coin_id.decode("utf-8") for symbol, coin_id in ids.items()}
+    _coin_names = {name.decode("utf-8"): symbol.decode("utf-8") for name, symbol in names.items()}
+    _updated = float(updated or 0)
+
+
+# Reload the shared registry from Redis, refreshing it upstream when it is due.
+# Only one process refreshes at a time; the others pick the result up from Redis.
+async def sync_symbols(context=None):
+    try:
+        updated = float(await redis_client.get(UPDATED_KEY) or 0)
+        if time.time() - updated >= SYMBOLS_REFRESH and await redis_client.set(LOCK_KEY, 1, nx=True, ex=300):
+            try:
+                await refresh_symbols()
+            finally:
+                await redis_client.delete(LOCK_KEY)
+        elif updated > _updated:
+            await load_symbols()
+    except Exception as e:
+        logging.error(f"Error syncing symbol registry: {e}")
@@ -0,0 +1,134 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import Counter
+
+import httpx
+
+# Local driver for webhook mode: record real updates, stand in for the Bot API and POST
+# recorded updates to a running bot.
+#
+#   TELEGRAM_API_KEY=... python -m tools.webhook_replay record updates.jsonl --count 20
+#   python -m tools.webhook_replay api --port 8081
+#   TELEGRAM_API_URL=http://127.0.0.1:8081/bot WEBHOOK_URL=http://127.0.0.1:8443 WEBHOOK_SECRET=s3cret \
+#       python alert.py
+#   python -m tools.webhook_replay post updates.jsonl --url http://127.0.0.1:8443/telegram --secret s3cret
+#
+# An updates file holds one Update object per line, as returned by getUpdates.
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def load_updates(path: str):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# getUpdates only answers while no webhook is set, so record before switching the bot over
+async def record(path: str, token: str, api_url: str, count: int, timeout: int):
+    offset = None
+    recorded = 0
+    async with httpx.AsyncClient(timeout=timeout + 10) as client:
+        with open(path, "a") as f:
+            while recorded < count:
+                params = {"timeout": timeout} if offset is None else {"timeout": timeout, "offset": offset}
+                response = await client.get(f"{api_url}{token}/getUpdates", params=params)
+                response.raise_for_status()
+                for update in response.json()["result"]:
+                    offset = update["update_id"] + 1
+                    f.write(json.dumps(update) + "\n")
+                    recorded += 1
+    logging.info(f"Recorded {recorded} updates to {path}")
+
+
+async def post(path: str, url: str, secret: str, repeat: int, concurrency: int):
+    updates = load_updates(path)
+    headers = {SECRET_HEADER: secret} if secret else {}
+    statuses = Counter()
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def post_one(client, update):
+        async with slots:
+            started = time.perf_counter()
+            response = await client.post(url, json=update, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] += 1
+
+    # Each pass gets fresh update ids, as Telegram would send for new messages
+    batch = []
+    for n in range(repeat):
+        for update in updates:
+            batch.append({**update, "update_id": update["update_id"] + n * len(updates)})
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=concurrency)) as client:
+        await asyncio.gather(*(post_one(client, update) for update in batch))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(json.dumps({
+        "updates": len(batch),
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(len(batch) / elapsed, 1) if elapsed else None,
+        "statuses": dict(statuses),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2) if latencies else None,
+    }, indent=2))
+
+
+# Answers getMe, setWebhook, sendMessage and friends so the bot can start without Telegram
+async def serve_api(port: int, latency: float):
+    from bench.fakes import FakeTelegram
+
+    api = await FakeTelegram(latency).start(port)
+    logging.info(f"Bot API stand-in on {api.url}/bot")
+    try:
+        await asyncio.Future()
+    finally:
+        logging.info(f"Sent {sum(api.sent.values())} messages to {len(api.sent)} chats")
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record Telegram updates or replay them against the webhook")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record")
+    record_parser.add_argument("path")
+    record_parser.add_argument("--token", help="defaults to TELEGRAM_API_KEY")
+    record_parser.add_argument("--api-url", default="https://api.telegram.org/bot")
+    record_parser.add_argument("--count", type=int, default=20)
+    record_parser.add_argument("--timeout", type=int, default=30)
+
+    post_parser = subparsers.add_parser("post")
+    post_parser.add_argument("path")
+    post_parser.add_argument("--url", default="http://127.0.0.1:8443/telegram")
+    post_parser.add_argument("--secret", default="")
+    post_parser.add_argument("--repeat", type=int, default=1)
+    post_parser.add_argument("--concurrency", type=int, default=10)
+
+    api_parser = subparsers.add_parser("api")
+    api_parser.add_argument("--port", type=int, default=8081)
+    api_parser.add_argument("--latency", type=float, default=0.0)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "record":
+        from tools.init import TELEGRAM_API_KEY
+
+        asyncio.run(record(args.path, args.token or TELEGRAM_API_KEY, args.api_url, args.count, args.timeout))
+    elif args.command == "post":
+        asyncio.run(post(args.path, args.url, args.secret, args.repeat, args.concurrency))
+    else:
+        try:
+            asyncio.run(serve_api(args.port, args.latency))
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
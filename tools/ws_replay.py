@@ -0,0 +1,71 @@
+import argparse
+import asyncio
+import logging
+
+import websockets
+
+# Local stand-in for the Binance WebSocket API that replays recorded frames.
+#
+#   python -m tools.ws_replay record frames.jsonl --count 60
+#   python -m tools.ws_replay serve frames.jsonl --port 8765
+#   BINANCE_WS_URL=ws://localhost:8765 STREAM_MODE=true python alert.py
+#
+# A frames file holds one raw stream message per line, as received from Binance.
+
+
+def load_frames(path: str):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+async def record(path: str, url: str, count: int):
+    async with websockets.connect(url, max_size=None) as ws:
+        with open(path, "w") as f:
+            for _ in range(count):
+                f.write(await ws.recv() + "\n")
+
+
+async def serve(path: str, host: str, port: int, interval: float, loop: bool):
+    frames = load_frames(path)
+
+    # Every connection gets its own replay from the first frame, whatever stream path it asked for
+    async def replay(websocket, *args):
+        while True:
+            for frame in frames:
+                await websocket.send(frame)
+                await asyncio.sleep(interval)
+            if not loop:
+                break
+
+    async with websockets.serve(replay, host, port):
+        logging.info(f"Replaying {len(frames)} frames on ws://{host}:{port}")
+        await asyncio.Future()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or replay Binance WebSocket frames")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record")
+    record_parser.add_argument("path")
+    record_parser.add_argument("--url", default="wss://stream.binance.com:9443/ws/!miniTicker@arr")
+    record_parser.add_argument("--count", type=int, default=60)
+
+    serve_parser = subparsers.add_parser("serve")
+    serve_parser.add_argument("path")
+    serve_parser.add_argument("--host", default="localhost")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--interval", type=float, default=1.0)
+    serve_parser.add_argument("--once", action="store_true", help="stop after one pass instead of looping")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "record":
+        asyncio.run(record(args.path, args.url, args.count))
+    else:
+        asyncio.run(serve(args.path, args.host, args.port, args.interval, not args.once))
+
+
+if __name__ == "__main__":
+    main()
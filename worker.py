@@ -0,0 +1,126 @@
+# Imported first so the startup timer covers every other import
+from tools.startup import StartupTimer
+
+import asyncio
+import logging
+import random
+
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+from binance_api.alert_index import build_alert_index, get_indexed_coins
+from binance_api.bn import evaluate_alerts
+from binance_api.candles import load_candles, save_candles
+from binance_api.scheduler import AlertScheduler
+from binance_api.shards import ShardOwner
+from binance_api.utils import get_price_snapshot, is_stream_live, load_price_snapshot, save_price_snapshot
+from tools.binance_gateway import BACKGROUND, set_priority
+from tools.metrics import instrument_redis, start_metrics_server
+from tools.notifier import get_notifier
+from tools.symbols import load_symbols, sync_symbols
+from tools.init import TELEGRAM_API_KEY, TELEGRAM_API_URL, ALERT_INTERVAL, STREAM_MODE, WORKER_HEARTBEAT, \
+    NOTIFY_CONCURRENCY, ALERT_SCHEDULER, ALERT_MIN_INTERVAL, ALERT_START_JITTER, redis_client
+
+# Alert worker: evaluates only the shards of coins this process holds leases for.
+# Run several of these next to alert.py (started with ALERT_WORKERS=true) against one Redis.
+
+logging.basicConfig(level=logging.INFO)
+
+
+async def evaluate_owned(bot: Bot, owner: ShardOwner, prices: dict):
+    coin_prices = {}
+    for coin_id in await get_indexed_coins():
+        if not owner.owns(coin_id):
+            continue
+
+        current_price = prices.get(f"{coin_id.upper()}USDT")
+        if current_price is not None:
+            coin_prices[coin_id] = current_price
+
+    if coin_prices:
+        await evaluate_alerts(bot, coin_prices)
+
+
+async def heartbeat_loop(owner: ShardOwner):
+    while True:
+        try:
+            await owner.heartbeat()
+        except Exception as e:
+            # Leases lapse after WORKER_TTL, so stop evaluating rather than risk a duplicate owner
+            logging.error(f"Worker heartbeat failed: {e}")
+            owner.owned = set()
+        await asyncio.sleep(WORKER_HEARTBEAT)
+
+
+async def alert_loop(bot: Bot, owner: ShardOwner):
+    scheduler = AlertScheduler()
+    # Workers restarted together by a redeploy spread their first cycles out
+    await asyncio.sleep(random.uniform(0, ALERT_START_JITTER))
+
+    while True:
+        if not is_stream_live():
+            try:
+                if ALERT_SCHEDULER == "adaptive":
+                    await scheduler.run_due(lambda coin_prices: evaluate_alerts(bot, coin_prices), owner.owns)
+                else:
+                    await evaluate_owned(bot, owner, await get_price_snapshot())
+            except Exception as e:
+                logging.error(f"Error checking alerts: {e}")
+        await asyncio.sleep(ALERT_MIN_INTERVAL if ALERT_SCHEDULER == "adaptive" else ALERT_INTERVAL)
+
+
+async def maintenance_loop():
+    while True:
+        await asyncio.sleep(300)
+        try:
+            await save_candles()
+            await save_price_snapshot()
+        except Exception as e:
+            logging.error(f"Error saving caches: {e}")
+        # sync_symbols logs its own errors
+        await sync_symbols()
+
+
+async def run_worker():
+    startup = StartupTimer("Worker")
+    startup.mark("imports")
+    # Workers never serve commands, so all their Binance requests are background work
+    set_priority(BACKGROUND)
+    instrument_redis(redis_client)
+    start_metrics_server()
+
+    owner = ShardOwner()
+    await build_alert_index()
+    # Restore the caches of the last run; the registry is refreshed upstream once the loops run
+    await asyncio.gather(startup.timed("candles", load_candles()), startup.timed("symbols", load_symbols()),
+                         startup.timed("prices", load_price_snapshot()))
+    startup.mark("restore")
+
+    # Take leases before the first cycle so it does not run with no shards
+    await owner.heartbeat()
+    startup.mark("leases")
+
+    # Bot defaults to a single connection, which the notifier's consumers would queue behind
+    request = HTTPXRequest(connection_pool_size=NOTIFY_CONCURRENCY)
+    async with Bot(TELEGRAM_API_KEY, base_url=TELEGRAM_API_URL, request=request) as bot:
+        await get_notifier(bot).start()
+        startup.mark("notifier")
+        startup.done()
+        tasks = [heartbeat_loop(owner), alert_loop(bot, owner), maintenance_loop(), sync_symbols()]
+        if STREAM_MODE:
+            from binance_api.stream import run_stream
+
+            tasks.append(run_stream(lambda prices: evaluate_owned(bot, owner, prices)))
+
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            await owner.leave()
+
+
+def main():
+    asyncio.run(run_worker())
+
+
+if __name__ == "__main__":
+    main()